@@ -0,0 +1,346 @@
+import json
+import base64
+import hmac
+import hashlib
+import math
+import os
+import re
+import secrets
+import time
+
+S = os.environ.get('MAIN_DB_SCHEMA', 'public')
+A = f'"{S}".attachments'
+AB = f'"{S}".attachment_blobs'
+RS = f'"{S}".revoked_sessions'
+
+ATTACHMENT_SQL = f"""
+    SELECT a.id, a.name, a.mime, a.expected_sha256, a.size, a.chunk_size, a.upload_key, a.upload_id, b.url, a.sha256, a.completing_at
+    FROM {A} a LEFT JOIN {AB} b ON b.sha256 = a.sha256
+    WHERE a.id = %s::uuid AND a.owner_id = %s::uuid
+"""
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+ATTACHMENT_PUBLIC_URL = os.environ.get('ATTACHMENT_PUBLIC_URL', '') or f"https://cdn.poehali.dev/projects/{os.environ.get('AWS_ACCESS_KEY_ID', '')}/files"
+ATTACHMENT_MAX_BYTES = int(os.environ.get('ATTACHMENT_MAX_BYTES', str(100 * 1024 * 1024)))
+# S3 не принимает части меньше 5 МиБ, кроме последней
+ATTACHMENT_CHUNK_BYTES = max(5 * 1024 * 1024, int(os.environ.get('ATTACHMENT_CHUNK_BYTES', str(5 * 1024 * 1024))))
+ATTACHMENT_URL_TTL_SEC = int(os.environ.get('ATTACHMENT_URL_TTL_SEC', '3600'))
+# Через сколько метка completing_at считается брошенной (функция упала посреди complete) и complete можно повторить
+ATTACHMENT_COMPLETE_TIMEOUT_SEC = int(os.environ.get('ATTACHMENT_COMPLETE_TIMEOUT_SEC', '900'))
+SHA256_RE = re.compile(r'[0-9a-f]{64}')
+S3 = {}
+
+SESSION_KEYS = {
+    kid: secret.encode()
+    for kid, _, secret in (item.strip().partition(':') for item in os.environ.get('SESSION_KEYS', '').split(','))
+    if kid and secret
+}
+AUTH_MODE = os.environ.get('AUTH_MODE', 'legacy')
+REVOCATION_CACHE_SEC = int(os.environ.get('REVOCATION_CACHE_SEC', '30'))
+REVOKED = {'jtis': set(), 'loaded_at': 0.0}
+
+
+def connect(url):
+    """psycopg2 импортируется при первом подключении, а не при загрузке модуля — быстрее холодный старт"""
+    import psycopg2
+    return psycopg2.connect(url)
+
+def get_db():
+    """Состояние загрузки должно быть свежим, поэтому все действия идут на primary"""
+    return connect(os.environ['DATABASE_URL'])
+
+def s3_client():
+    """boto3 импортируется и клиент создаётся один раз на тёплый инстанс. S3_ENDPOINT_URL позволяет подставить локальный S3 (MinIO)"""
+    if 'client' not in S3:
+        import boto3
+        S3['client'] = boto3.client('s3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        )
+    return S3['client']
+
+def upload_key():
+    """Случайный ключ на каждую загрузку: по SHA-256 файла нельзя ни найти объект, ни узнать, что он уже загружен"""
+    return f'attachments/{secrets.token_hex(16)}'
+
+def part_count(size, chunk_size):
+    return max(1, math.ceil(size / chunk_size))
+
+def part_size(size, chunk_size, part):
+    return min(chunk_size, size - (part - 1) * chunk_size)
+
+def uploaded_parts(s3, key, upload_id, size, chunk_size):
+    """Номера уже загруженных частей правильного размера и их ETag — по ним клиент продолжает прерванную загрузку"""
+    parts = {}
+    marker = 0
+    while True:
+        res = s3.list_parts(Bucket=S3_BUCKET, Key=key, UploadId=upload_id, PartNumberMarker=marker)
+        for p in res.get('Parts', []):
+            if p['Size'] == part_size(size, chunk_size, p['PartNumber']):
+                parts[p['PartNumber']] = p['ETag']
+        if not res.get('IsTruncated'):
+            return parts
+        marker = res['NextPartNumberMarker']
+
+def part_urls(s3, key, upload_id, parts):
+    """Части клиент кладёт PUT-ом прямо в S3 по подписанным ссылкам — через функцию они не проходят"""
+    return {str(p): s3.generate_presigned_url('upload_part', Params={
+        'Bucket': S3_BUCKET, 'Key': key, 'UploadId': upload_id, 'PartNumber': p,
+    }, ExpiresIn=ATTACHMENT_URL_TTL_SEC) for p in parts}
+
+def object_sha256(s3, key):
+    """Хеш собранного объекта считается потоково, без загрузки файла в память целиком"""
+    digest = hashlib.sha256()
+    body = s3.get_object(Bucket=S3_BUCKET, Key=key)['Body']
+    for chunk in body.iter_chunks(1024 * 1024):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+def upload_state(row, s3=None):
+    """Для незавершённой загрузки — какие части уже в S3 и подписанные ссылки на остальные.
+    Собранный, но ещё не проверенный объект (upload_id уже NULL) отдаётся как verifying"""
+    size, chunk_size = row[4], row[5]
+    state = {
+        'attachment_id': str(row[0]),
+        'name': row[1],
+        'mime': row[2],
+        'sha256': row[3],
+        'size': size,
+        'status': 'ready' if row[9] else ('uploading' if row[7] else 'verifying'),
+        'url': row[8],
+    }
+    if not row[9] and row[7]:
+        uploaded = uploaded_parts(s3, row[6], row[7], size, chunk_size)
+        missing = [p for p in range(1, part_count(size, chunk_size) + 1) if p not in uploaded]
+        state.update({
+            'chunk_size': chunk_size,
+            'parts': part_count(size, chunk_size),
+            'uploaded': sorted(uploaded),
+            'part_urls': part_urls(s3, row[6], row[7], missing),
+        })
+    return state
+
+def finish_completing(conn, attachment_id, upload_id):
+    """Снимает метку completing_at после неудачного complete и запоминает, какой multipart upload теперь актуален"""
+    cur = conn.cursor()
+    cur.execute(f"UPDATE {A} SET completing_at = NULL, upload_id = %s WHERE id = %s::uuid", (upload_id, attachment_id))
+    conn.commit()
+    conn.close()
+
+def b64url_decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def verify_session(token):
+    """Токен kid.payload.signature (HMAC-SHA256) проверяется в процессе, без запроса к БД; возвращает claims или None"""
+    try:
+        kid, payload, signature = token.split('.')
+        key = SESSION_KEYS.get(kid)
+        if not key:
+            return None
+        expected = hmac.new(key, f'{kid}.{payload}'.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, b64url_decode(signature)):
+            return None
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(claims, dict) or not claims.get('uid') or claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+def authenticate(req_headers, fallback_user_id, action):
+    """user_id из X-Auth-Token; без токена в AUTH_MODE=legacy — как раньше из x-user-id/body/query. None — отказать с 401"""
+    token = req_headers.get('x-auth-token', '')
+    if token:
+        claims = verify_session(token)
+        return (claims['uid'], claims) if claims else (None, None)
+    if AUTH_MODE == 'token' and action:
+        return None, None
+    return fallback_user_id, None
+
+def is_revoked(conn, claims):
+    """Список отозванных сессий кешируется в процессе на REVOCATION_CACHE_SEC; без conn используется кеш как есть"""
+    now = time.time()
+    if conn is not None and now - REVOKED['loaded_at'] > REVOCATION_CACHE_SEC:
+        cur = conn.cursor()
+        cur.execute(f"SELECT jti FROM {RS} WHERE expires_at > now()")
+        REVOKED['jtis'] = {r[0] for r in cur.fetchall()}
+        REVOKED['loaded_at'] = now
+    return claims.get('jti') in REVOKED['jtis']
+
+def unauthorized(headers):
+    return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Требуется авторизация'})}
+
+def parse_body(event):
+    raw = event.get('body') or ''
+    if not raw or not raw.strip():
+        return {}
+    if event.get('isBase64Encoded'):
+        try:
+            raw = base64.b64decode(raw).decode('utf-8')
+        except Exception:
+            pass
+    try:
+        return json.loads(raw)
+    except Exception:
+        try:
+            return json.loads(base64.b64decode(raw).decode('utf-8'))
+        except Exception:
+            return {}
+
+def storage_error(headers, e):
+    print(f"[ATTACHMENTS] S3 error: {e}")
+    return {'statusCode': 502, 'headers': headers, 'body': json.dumps({'error': 'Хранилище файлов недоступно, попробуйте позже'})}
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Last-Write', 'Access-Control-Max-Age': '86400'}
+HEADERS = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+
+def handler(event, context):
+    """Вложения к сообщениям Того — загрузка частями напрямую в S3 с докачкой и хранение одной копии на SHA-256"""
+    if event.get('httpMethod') == 'OPTIONS':
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
+
+    headers = HEADERS
+    method = event.get('httpMethod', 'GET')
+    params = event.get('queryStringParameters', {}) or {}
+    body = parse_body(event)
+    action = params.get('action', '') or body.get('action', '')
+    req_headers = event.get('headers', {}) or {}
+    user_id, claims = authenticate(req_headers, req_headers.get('x-user-id', '') or body.get('user_id', '') or params.get('user_id', ''), action)
+    if user_id is None:
+        return unauthorized(headers)
+
+    if not action:
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'service': 'attachments', 'status': 'ok'})}
+
+    attachment_id = params.get('attachment_id', '') or body.get('attachment_id', '')
+    if not user_id or (action != 'init' and not attachment_id):
+        return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id and attachment_id required'})}
+
+    conn = get_db()
+    cur = conn.cursor()
+
+    if claims and is_revoked(conn, claims):
+        conn.close()
+        return unauthorized(headers)
+
+    if method == 'POST' and action == 'init':
+        sha256 = str(body.get('sha256', '')).lower()
+        name = str(body.get('name', ''))[:255]
+        mime = str(body.get('mime', '') or 'application/octet-stream')[:127]
+        try:
+            size = int(body.get('size', 0))
+        except (TypeError, ValueError):
+            size = 0
+
+        if not SHA256_RE.fullmatch(sha256) or size < 1:
+            conn.close()
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'sha256 (hex) and size required'})}
+        if size > ATTACHMENT_MAX_BYTES:
+            conn.close()
+            return {'statusCode': 413, 'headers': headers, 'body': json.dumps({'error': f'Файл больше {ATTACHMENT_MAX_BYTES // (1024 * 1024)} МБ'})}
+
+        # Загрузка начинается всегда, даже если такое содержимое уже хранится: ответ init не выдаёт, есть ли файл,
+        # а готовым вложение становится только после загрузки и проверки хеша в complete
+        key = upload_key()
+        s3 = s3_client()
+        try:
+            upload = s3.create_multipart_upload(Bucket=S3_BUCKET, Key=key, ContentType=mime)
+        except Exception as e:
+            conn.close()
+            return storage_error(headers, e)
+        cur.execute(f"""
+            INSERT INTO {A} (owner_id, name, mime, expected_sha256, size, chunk_size, upload_key, upload_id)
+            VALUES (%s::uuid, %s, %s, %s, %s, %s, %s, %s) RETURNING id
+        """, (user_id, name, mime, sha256, size, ATTACHMENT_CHUNK_BYTES, key, upload['UploadId']))
+        cur.execute(ATTACHMENT_SQL, (cur.fetchone()[0], user_id))
+        row = cur.fetchone()
+        conn.commit()
+        conn.close()
+
+        try:
+            state = upload_state(row, s3)
+        except Exception as e:
+            return storage_error(headers, e)
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(state)}
+
+    cur.execute(ATTACHMENT_SQL, (attachment_id, user_id))
+    row = cur.fetchone()
+    if not row:
+        conn.close()
+        return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Attachment not found'})}
+    if row[9]:
+        conn.close()
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(upload_state(row))}
+    sha256, size, chunk_size, key, upload_id = row[3], row[4], row[5], row[6], row[7]
+
+    if action == 'status':
+        conn.close()
+        try:
+            state = upload_state(row, s3_client())
+        except Exception as e:
+            return storage_error(headers, e)
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(state)}
+
+    if method == 'POST' and action == 'complete':
+        # Сборка в S3 и хеширование идут вне транзакции: короткий UPDATE ставит метку completing_at и сразу
+        # коммитится, а повторный complete, пока метка свежая, получает 409 вместо ожидания на блокировке
+        cur.execute(f"""
+            UPDATE {A} SET completing_at = now()
+            WHERE id = %s::uuid AND sha256 IS NULL
+              AND (completing_at IS NULL OR completing_at < now() - make_interval(secs => %s))
+        """, (attachment_id, ATTACHMENT_COMPLETE_TIMEOUT_SEC))
+        claimed = cur.rowcount
+        conn.commit()
+        if not claimed:
+            conn.close()
+            return {'statusCode': 409, 'headers': headers, 'body': json.dumps({'error': 'Загрузка уже завершается'})}
+
+        s3 = s3_client()
+        try:
+            # upload_id пуст, если прошлый complete уже собрал объект, но не успел его проверить
+            if upload_id:
+                uploaded = uploaded_parts(s3, key, upload_id, size, chunk_size)
+                missing = [p for p in range(1, part_count(size, chunk_size) + 1) if p not in uploaded]
+                if missing:
+                    finish_completing(conn, attachment_id, upload_id)
+                    return {'statusCode': 409, 'headers': headers, 'body': json.dumps({'error': 'Не все части загружены', 'missing': missing[:100]})}
+
+                s3.complete_multipart_upload(Bucket=S3_BUCKET, Key=key, UploadId=upload_id, MultipartUpload={
+                    'Parts': [{'PartNumber': p, 'ETag': uploaded[p]} for p in sorted(uploaded)],
+                })
+                upload_id = None
+                cur.execute(f"UPDATE {A} SET upload_id = NULL WHERE id = %s::uuid", (attachment_id,))
+                conn.commit()
+
+            if object_sha256(s3, key) != sha256:
+                # Новая загрузка под тем же ключом перезапишет объект, так что сбой удаления ничего не оставит
+                upload_id = s3.create_multipart_upload(Bucket=S3_BUCKET, Key=key, ContentType=row[2])['UploadId']
+                s3.delete_object(Bucket=S3_BUCKET, Key=key)
+                finish_completing(conn, attachment_id, upload_id)
+                return {'statusCode': 422, 'headers': headers, 'body': json.dumps({'error': 'Контрольная сумма не совпала, загрузите файл заново'})}
+        except Exception as e:
+            finish_completing(conn, attachment_id, upload_id)
+            return storage_error(headers, e)
+
+        # Содержимое проверено — теперь его можно дедуплицировать: если такой blob уже есть, своя копия лишняя
+        cur.execute(
+            f"INSERT INTO {AB} (sha256, size, storage_key, url) VALUES (%s, %s, %s, %s) ON CONFLICT (sha256) DO NOTHING RETURNING sha256",
+            (sha256, size, key, f'{ATTACHMENT_PUBLIC_URL}/{key}')
+        )
+        duplicate = cur.fetchone() is None
+        cur.execute(f"UPDATE {A} SET sha256 = %s, upload_id = NULL, completing_at = NULL WHERE id = %s::uuid", (sha256, attachment_id))
+        cur.execute(ATTACHMENT_SQL, (attachment_id, user_id))
+        row = cur.fetchone()
+        conn.commit()
+        conn.close()
+        if duplicate:
+            try:
+                s3.delete_object(Bucket=S3_BUCKET, Key=key)
+            except Exception as e:
+                print(f"[ATTACHMENTS] S3 error: {e}")
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(upload_state(row))}
+
+    conn.close()
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'service': 'attachments', 'status': 'ok'})}
@@ -1,13 +1,22 @@
 import json
+import base64
+import hmac
 import os
+import math
+import time
 import hashlib
 import uuid
 import re
-import psycopg2
 
 
 S = os.environ.get('MAIN_DB_SCHEMA', 'public')
 U = f'"{S}".users'
+RL = f'"{S}".rate_limits'
+RS = f'"{S}".revoked_sessions'
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'postgres')
+RATE_LIMITS = {'search': (20, 0.5)}
+BUCKETS = {}
 
 def clean_phone(phone):
     digits = re.sub(r'\D', '', phone)
@@ -25,8 +34,138 @@ def verify_password(stored, provided):
     hash_val, salt = stored.split(':')
     return hash_val == hashlib.sha256((salt + provided).encode()).hexdigest()
 
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+SESSION_KEYS = {
+    kid: secret.encode()
+    for kid, _, secret in (item.strip().partition(':') for item in os.environ.get('SESSION_KEYS', '').split(','))
+    if kid and secret
+}
+AUTH_MODE = os.environ.get('AUTH_MODE', 'legacy')
+REVOCATION_CACHE_SEC = int(os.environ.get('REVOCATION_CACHE_SEC', '30'))
+REVOKED = {'jtis': set(), 'loaded_at': 0.0}
+SESSION_TTL_SEC = int(os.environ.get('SESSION_TTL_SEC', str(30 * 24 * 3600)))
+PUBLIC_ACTIONS = {'register', 'login'}
+
+def connect(url):
+    """psycopg2 импортируется при первом подключении, а не при загрузке модуля — быстрее холодный старт"""
+    import psycopg2
+    return psycopg2.connect(url)
+
+READ_ACTIONS = {'search'}
+READ_AFTER_WRITE_SEC = float(os.environ.get('READ_AFTER_WRITE_SEC', '5'))
+LAST_WRITE = {}
+
+def get_db(action='', user_id='', req_headers=None):
+    """Read-only действия идут на DATABASE_READ_URL, если пользователь недавно ничего не писал; остальное — на primary"""
+    now = time.time()
+    read_url = os.environ.get('DATABASE_READ_URL', '')
+    if action in READ_ACTIONS:
+        if read_url and not wrote_recently(user_id, req_headers or {}, now):
+            return connect(read_url)
+    elif action and user_id:
+        if len(LAST_WRITE) > 10000:
+            for uid in [u for u, t in LAST_WRITE.items() if now - t >= READ_AFTER_WRITE_SEC]:
+                del LAST_WRITE[uid]
+        LAST_WRITE[user_id] = now
+    return connect(os.environ['DATABASE_URL'])
+
+def wrote_recently(user_id, req_headers, now):
+    """X-Last-Write — сколько мс назад клиент сделал запись (возраст, а не время: не зависит от часов клиента)"""
+    if user_id and now - LAST_WRITE.get(user_id, 0) < READ_AFTER_WRITE_SEC:
+        return True
+    try:
+        return float(req_headers.get('x-last-write', '')) / 1000 < READ_AFTER_WRITE_SEC
+    except ValueError:
+        return False
+
+def take_token(conn, user_id, action):
+    """Токен-бакет на пару (пользователь, действие): 0 — запрос разрешён, иначе через сколько секунд повторить"""
+    if action not in RATE_LIMITS or not user_id or RATE_LIMIT_BACKEND == 'off':
+        return 0
+    capacity, per_sec = RATE_LIMITS[action]
+    if RATE_LIMIT_BACKEND == 'memory':
+        now = time.monotonic()
+        tokens, updated_at = BUCKETS.get((user_id, action), (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * per_sec)
+        if tokens < 1:
+            BUCKETS[(user_id, action)] = (tokens, now)
+            return (1 - tokens) / per_sec
+        BUCKETS[(user_id, action)] = (tokens - 1, now)
+        return 0
+
+    own_conn = conn is None
+    if own_conn:
+        conn = connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute(f"""
+        INSERT INTO {RL} AS rl (user_id, action, tokens, updated_at) VALUES (%s, %s, %s - 1, now())
+        ON CONFLICT (user_id, action) DO UPDATE
+        SET tokens = LEAST(%s, rl.tokens + EXTRACT(EPOCH FROM now() - rl.updated_at) * %s) - 1, updated_at = now()
+        WHERE LEAST(%s, rl.tokens + EXTRACT(EPOCH FROM now() - rl.updated_at) * %s) >= 1
+        RETURNING tokens
+    """, (user_id, action, capacity, capacity, per_sec, capacity, per_sec))
+    allowed = cur.fetchone() is not None
+    conn.commit()
+    if own_conn:
+        conn.close()
+    return 0 if allowed else 1 / per_sec
+
+def too_many_requests(headers, retry_after):
+    return {'statusCode': 429, 'headers': {**headers, 'Retry-After': str(math.ceil(retry_after))}, 'body': json.dumps({'error': 'Слишком много запросов, попробуйте позже', 'retry_after': round(retry_after, 1)})}
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+def b64url_decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def verify_session(token):
+    """Токен kid.payload.signature (HMAC-SHA256) проверяется в процессе, без запроса к БД; возвращает claims или None"""
+    try:
+        kid, payload, signature = token.split('.')
+        key = SESSION_KEYS.get(kid)
+        if not key:
+            return None
+        expected = hmac.new(key, f'{kid}.{payload}'.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, b64url_decode(signature)):
+            return None
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(claims, dict) or not claims.get('uid') or claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+def authenticate(req_headers, fallback_user_id, action):
+    """user_id из X-Auth-Token; без токена в AUTH_MODE=legacy — как раньше из x-user-id/body/query. None — отказать с 401"""
+    token = req_headers.get('x-auth-token', '')
+    if token:
+        claims = verify_session(token)
+        return (claims['uid'], claims) if claims else (None, None)
+    if AUTH_MODE == 'token' and action:
+        return None, None
+    return fallback_user_id, None
+
+def is_revoked(conn, claims):
+    """Список отозванных сессий кешируется в процессе на REVOCATION_CACHE_SEC; без conn используется кеш как есть"""
+    now = time.time()
+    if conn is not None and now - REVOKED['loaded_at'] > REVOCATION_CACHE_SEC:
+        cur = conn.cursor()
+        cur.execute(f"SELECT jti FROM {RS} WHERE expires_at > now()")
+        REVOKED['jtis'] = {r[0] for r in cur.fetchall()}
+        REVOKED['loaded_at'] = now
+    return claims.get('jti') in REVOKED['jtis']
+
+def issue_session(user_id):
+    """Подписывает токен первым ключом из SESSION_KEYS; без ключей токены не выдаются"""
+    if not SESSION_KEYS:
+        return None
+    kid = next(iter(SESSION_KEYS))
+    payload = b64url(json.dumps({'uid': user_id, 'jti': uuid.uuid4().hex, 'exp': int(time.time()) + SESSION_TTL_SEC}).encode())
+    signature = b64url(hmac.new(SESSION_KEYS[kid], f'{kid}.{payload}'.encode(), hashlib.sha256).digest())
+    return f'{kid}.{payload}.{signature}'
+
+def unauthorized(headers):
+    return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Требуется авторизация'})}
 
 def parse_body(event):
     import base64 as b64
@@ -48,21 +187,33 @@ def parse_body(event):
     except Exception:
         return {}
 
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id, X-Last-Write', 'Access-Control-Max-Age': '86400'}
+HEADERS = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+
 def handler(event, context):
     """Регистрация и авторизация пользователей мессенджера Того по телефону"""
     if event.get('httpMethod') == 'OPTIONS':
-        return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id', 'Access-Control-Max-Age': '86400'}, 'body': ''}
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
-    headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+    headers = HEADERS
     method = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters', {}) or {}
     body = parse_body(event)
     action = params.get('action', '') or body.get('action', '')
     print(f"[AUTH] {method} action={action} body_keys={list(body.keys())} isBase64={event.get('isBase64Encoded')}")
 
-    conn = get_db()
+    req_headers = event.get('headers', {}) or {}
+    session_user_id, claims = ('', None) if action in PUBLIC_ACTIONS else authenticate(req_headers, body.get('user_id', ''), action)
+    if session_user_id is None:
+        return unauthorized(headers)
+
+    conn = get_db(action, session_user_id, req_headers)
     cur = conn.cursor()
 
+    if claims and is_revoked(conn, claims):
+        conn.close()
+        return unauthorized(headers)
+
     if method == 'POST' and action == 'register':
         phone = clean_phone(body.get('phone', ''))
         display_name = body.get('display_name', '').strip()
@@ -96,7 +247,7 @@ def handler(event, context):
         conn.commit()
         conn.close()
 
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'user_id': user_id, 'phone': phone, 'display_name': display_name, 'avatar': avatar})}
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'user_id': user_id, 'phone': phone, 'display_name': display_name, 'avatar': avatar, 'token': issue_session(user_id)})}
 
     if method == 'POST' and action == 'login':
         phone = clean_phone(body.get('phone', ''))
@@ -116,16 +267,33 @@ def handler(event, context):
         conn.commit()
         conn.close()
 
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'user_id': str(row[0]), 'phone': row[5], 'display_name': row[2], 'avatar': row[4]})}
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'user_id': str(row[0]), 'phone': row[5], 'display_name': row[2], 'avatar': row[4], 'token': issue_session(str(row[0]))})}
+
+    if method == 'POST' and action == 'logout':
+        if not claims:
+            conn.close()
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'X-Auth-Token required'})}
+
+        cur.execute(f"INSERT INTO {RS} (jti, user_id, expires_at) VALUES (%s, %s::uuid, to_timestamp(%s) AT TIME ZONE 'UTC') ON CONFLICT (jti) DO NOTHING", (claims['jti'], claims['uid'], claims['exp']))
+        conn.commit()
+        conn.close()
+        REVOKED['jtis'].add(claims['jti'])
+
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'ok': True})}
 
     if method == 'POST' and action == 'search':
         raw_query = body.get('query', '').strip()
-        user_id = body.get('user_id', '')
+        user_id = session_user_id
 
         if not raw_query or len(raw_query) < 2:
             conn.close()
             return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'users': []})}
 
+        retry_after = take_token(None if os.environ.get('DATABASE_READ_URL') else conn, user_id, 'search')
+        if retry_after:
+            conn.close()
+            return too_many_requests(headers, retry_after)
+
         phone_query = clean_phone(raw_query)
         name_pattern = f'%{raw_query}%'
 
@@ -145,7 +313,7 @@ def handler(event, context):
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'users': users})}
 
     if method == 'POST' and action == 'update_profile':
-        user_id = body.get('user_id', '')
+        user_id = session_user_id
         display_name = body.get('display_name', '').strip()
         avatar = body.get('avatar', '').strip()
 
@@ -173,7 +341,7 @@ def handler(event, context):
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'user_id': user_id, 'phone': row[1], 'display_name': row[2], 'avatar': row[3]})}
 
     if method == 'POST' and action == 'status':
-        user_id = body.get('user_id', '')
+        user_id = session_user_id
         is_online = body.get('online', False)
 
         if user_id:
@@ -1,15 +1,169 @@
 import json
+import base64
+import hmac
+import hashlib
 import os
-import psycopg2
+import time
 
 S = os.environ.get('MAIN_DB_SCHEMA', 'public')
 U = f'"{S}".users'
 C = f'"{S}".chats'
 CM = f'"{S}".chat_members'
 M = f'"{S}".messages'
+RS = f'"{S}".revoked_sessions'
 
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+CHATS_LIST_SQL = f"""
+    SELECT c.id, c.is_group, c.name,
+           u2.id, u2.username, u2.display_name, u2.avatar, u2.is_online,
+           (SELECT text FROM {M} WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1),
+           (SELECT created_at FROM {M} WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1),
+           (SELECT COUNT(*) FROM {M} WHERE chat_id = c.id AND sender_id != %s::uuid AND created_at > COALESCE(cm.read_up_to, 'epoch'))
+    FROM {C} c
+    JOIN {CM} cm ON cm.chat_id = c.id AND cm.user_id = %s::uuid AND cm.left_at IS NULL
+    LEFT JOIN {CM} cm2 ON cm2.chat_id = c.id AND cm2.user_id != %s::uuid AND cm2.left_at IS NULL
+    LEFT JOIN {U} u2 ON u2.id = cm2.user_id
+    ORDER BY (SELECT created_at FROM {M} WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) DESC NULLS LAST
+"""
+
+SESSION_KEYS = {
+    kid: secret.encode()
+    for kid, _, secret in (item.strip().partition(':') for item in os.environ.get('SESSION_KEYS', '').split(','))
+    if kid and secret
+}
+AUTH_MODE = os.environ.get('AUTH_MODE', 'legacy')
+REVOCATION_CACHE_SEC = int(os.environ.get('REVOCATION_CACHE_SEC', '30'))
+REVOKED = {'jtis': set(), 'loaded_at': 0.0}
+
+PREPARED_STATEMENTS = os.environ.get('PREPARED_STATEMENTS', '1') == '1'
+CONN_MAX_IDLE_SEC = int(os.environ.get('CONN_MAX_IDLE_SEC', '60'))
+CONNECTIONS = {}
+
+def connect(url):
+    """psycopg2 импортируется при первом подключении, а не при загрузке модуля — быстрее холодный старт.
+    С PREPARED_STATEMENTS тёплый инстанс держит по соединению на URL, чтобы подготовленные запросы жили между вызовами"""
+    import psycopg2
+    import psycopg2.extensions
+    if not PREPARED_STATEMENTS:
+        return psycopg2.connect(url)
+    now = time.time()
+    cached = CONNECTIONS.get(url)
+    if cached and not cached['conn'].closed and now - cached['used_at'] < CONN_MAX_IDLE_SEC:
+        cached['used_at'] = now
+        if cached['conn'].get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            cached['conn'].rollback()
+        return cached['conn']
+    if cached and not cached['conn'].closed:
+        cached['conn'].close()
+    conn = psycopg2.connect(url)
+    CONNECTIONS[url] = {'conn': conn, 'prepared': set(), 'used_at': now}
+    return conn
+
+def release(conn):
+    """Переиспользуемое соединение только откатывает незавершённую транзакцию, остальные закрываются"""
+    if PREPARED_STATEMENTS and not conn.closed:
+        conn.rollback()
+    else:
+        conn.close()
+
+def to_positional(sql):
+    parts = sql.split('%s')
+    return ''.join(part + (f'${i + 1}' if i < len(parts) - 1 else '') for i, part in enumerate(parts))
+
+def execute(cur, name, sql, args):
+    """Горячий запрос: PREPARE один раз на соединение, дальше EXECUTE — Postgres не разбирает и не планирует его заново.
+    Если сервер закрыл сохранённое соединение (рестарт, failover, idle-таймаут), оно открывается заново и запрос
+    повторяется один раз. Возвращает курсор, из которого читать результат"""
+    import psycopg2
+    entry = next((c for c in CONNECTIONS.values() if c['conn'] is cur.connection), None)
+    if not PREPARED_STATEMENTS or entry is None:
+        cur.execute(sql, args)
+        return cur
+    try:
+        execute_prepared(cur, entry, name, sql, args)
+    except psycopg2.OperationalError:
+        if not cur.connection.closed:
+            raise
+        url = next(u for u, c in CONNECTIONS.items() if c is entry)
+        del CONNECTIONS[url]
+        cur = connect(url).cursor()
+        execute_prepared(cur, CONNECTIONS[url], name, sql, args)
+    return cur
+
+def execute_prepared(cur, entry, name, sql, args):
+    if name not in entry['prepared']:
+        cur.execute(f'PREPARE {name} AS {to_positional(sql)}')
+        entry['prepared'].add(name)
+    cur.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(args))})', args)
+
+READ_ACTIONS = {'list'}
+READ_AFTER_WRITE_SEC = float(os.environ.get('READ_AFTER_WRITE_SEC', '5'))
+LAST_WRITE = {}
+
+def get_db(action='', user_id='', req_headers=None):
+    """Read-only действия идут на DATABASE_READ_URL, если пользователь недавно ничего не писал; остальное — на primary"""
+    now = time.time()
+    read_url = os.environ.get('DATABASE_READ_URL', '')
+    if action in READ_ACTIONS:
+        if read_url and not wrote_recently(user_id, req_headers or {}, now):
+            return connect(read_url)
+    elif action and user_id:
+        if len(LAST_WRITE) > 10000:
+            for uid in [u for u, t in LAST_WRITE.items() if now - t >= READ_AFTER_WRITE_SEC]:
+                del LAST_WRITE[uid]
+        LAST_WRITE[user_id] = now
+    return connect(os.environ['DATABASE_URL'])
+
+def wrote_recently(user_id, req_headers, now):
+    """X-Last-Write — сколько мс назад клиент сделал запись (возраст, а не время: не зависит от часов клиента)"""
+    if user_id and now - LAST_WRITE.get(user_id, 0) < READ_AFTER_WRITE_SEC:
+        return True
+    try:
+        return float(req_headers.get('x-last-write', '')) / 1000 < READ_AFTER_WRITE_SEC
+    except ValueError:
+        return False
+
+def b64url_decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def verify_session(token):
+    """Токен kid.payload.signature (HMAC-SHA256) проверяется в процессе, без запроса к БД; возвращает claims или None"""
+    try:
+        kid, payload, signature = token.split('.')
+        key = SESSION_KEYS.get(kid)
+        if not key:
+            return None
+        expected = hmac.new(key, f'{kid}.{payload}'.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, b64url_decode(signature)):
+            return None
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(claims, dict) or not claims.get('uid') or claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+def authenticate(req_headers, fallback_user_id, action):
+    """user_id из X-Auth-Token; без токена в AUTH_MODE=legacy — как раньше из x-user-id/body/query. None — отказать с 401"""
+    token = req_headers.get('x-auth-token', '')
+    if token:
+        claims = verify_session(token)
+        return (claims['uid'], claims) if claims else (None, None)
+    if AUTH_MODE == 'token' and action:
+        return None, None
+    return fallback_user_id, None
+
+def is_revoked(conn, claims):
+    """Список отозванных сессий кешируется в процессе на REVOCATION_CACHE_SEC; без conn используется кеш как есть"""
+    now = time.time()
+    if conn is not None and now - REVOKED['loaded_at'] > REVOCATION_CACHE_SEC:
+        cur = conn.cursor()
+        cur.execute(f"SELECT jti FROM {RS} WHERE expires_at > now()")
+        REVOKED['jtis'] = {r[0] for r in cur.fetchall()}
+        REVOKED['loaded_at'] = now
+    return claims.get('jti') in REVOKED['jtis']
+
+def unauthorized(headers):
+    return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Требуется авторизация'})}
 
 def parse_body(event):
     import base64 as b64
@@ -31,39 +185,37 @@ def parse_body(event):
     except Exception:
         return {}
 
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id, X-Last-Write', 'Access-Control-Max-Age': '86400'}
+HEADERS = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+
 def handler(event, context):
     """Управление чатами Того — создание, получение списка чатов пользователя"""
     if event.get('httpMethod') == 'OPTIONS':
-        return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id', 'Access-Control-Max-Age': '86400'}, 'body': ''}
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
-    headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+    headers = HEADERS
     method = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters', {}) or {}
     body = parse_body(event)
     action = params.get('action', '') or body.get('action', '')
-    req_headers = event.get('headers', {})
-    user_id = req_headers.get('x-user-id', '') or body.get('user_id', '') or params.get('user_id', '')
+    req_headers = event.get('headers', {}) or {}
+    user_id, claims = authenticate(req_headers, req_headers.get('x-user-id', '') or body.get('user_id', '') or params.get('user_id', ''), action)
+    if user_id is None:
+        return unauthorized(headers)
 
-    conn = get_db()
+    conn = get_db(action, user_id, req_headers)
     cur = conn.cursor()
 
+    if claims and is_revoked(conn, claims):
+        release(conn)
+        return unauthorized(headers)
+
     if action == 'list':
         if not user_id:
-            conn.close()
+            release(conn)
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id required'})}
 
-        cur.execute(f"""
-            SELECT c.id, c.is_group, c.name,
-                   u2.id, u2.username, u2.display_name, u2.avatar, u2.is_online,
-                   (SELECT text FROM {M} WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1),
-                   (SELECT created_at FROM {M} WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1),
-                   (SELECT COUNT(*) FROM {M} WHERE chat_id = c.id AND sender_id != %s::uuid AND status = 'sent')
-            FROM {C} c
-            JOIN {CM} cm ON cm.chat_id = c.id AND cm.user_id = %s::uuid AND cm.left_at IS NULL
-            LEFT JOIN {CM} cm2 ON cm2.chat_id = c.id AND cm2.user_id != %s::uuid AND cm2.left_at IS NULL
-            LEFT JOIN {U} u2 ON u2.id = cm2.user_id
-            ORDER BY (SELECT created_at FROM {M} WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) DESC NULLS LAST
-        """, (user_id, user_id, user_id))
+        cur = execute(cur, 'chats_list', CHATS_LIST_SQL, (user_id, user_id, user_id))
 
         chats = []
         for r in cur.fetchall():
@@ -81,13 +233,13 @@ def handler(event, context):
                 'unread': r[10] or 0,
             })
 
-        conn.close()
+        release(cur.connection)
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'chats': chats})}
 
     if method == 'POST' and action == 'create':
         partner_id = body.get('partner_id', '')
         if not user_id or not partner_id:
-            conn.close()
+            release(conn)
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id and partner_id required'})}
 
         cur.execute(f"""
@@ -110,7 +262,7 @@ def handler(event, context):
 
         cur.execute(f"SELECT id, username, display_name, avatar, is_online FROM {U} WHERE id = %s::uuid", (partner_id,))
         partner = cur.fetchone()
-        conn.close()
+        release(conn)
 
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
             'chat_id': chat_id,
@@ -122,11 +274,11 @@ def handler(event, context):
         member_ids = body.get('member_ids', [])
 
         if not user_id or not name:
-            conn.close()
+            release(conn)
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id and name required'})}
 
         if len(member_ids) < 1:
-            conn.close()
+            release(conn)
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Добавьте хотя бы одного участника'})}
 
         avatar = name[0].upper()
@@ -138,7 +290,7 @@ def handler(event, context):
             cur.execute(f"INSERT INTO {CM} (chat_id, user_id) VALUES (%s::uuid, %s::uuid)", (chat_id, mid))
 
         conn.commit()
-        conn.close()
+        release(conn)
 
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
             'chat_id': chat_id,
@@ -150,10 +302,16 @@ def handler(event, context):
     if method == 'POST' and action == 'read':
         chat_id = body.get('chat_id', '')
         if user_id and chat_id:
-            cur.execute(f"UPDATE {M} SET status = 'delivered' WHERE chat_id = %s::uuid AND sender_id != %s::uuid AND status = 'sent'", (chat_id, user_id))
+            up_to = body.get('up_to') or None
+            cur.execute(f"""
+                UPDATE {CM} SET
+                    read_up_to = GREATEST(COALESCE(read_up_to, 'epoch'), LEAST(COALESCE(%s::timestamp, now()), now())),
+                    delivered_up_to = GREATEST(COALESCE(delivered_up_to, 'epoch'), LEAST(COALESCE(%s::timestamp, now()), now()))
+                WHERE chat_id = %s::uuid AND user_id = %s::uuid
+            """, (up_to, up_to, chat_id, user_id))
             conn.commit()
-        conn.close()
+        release(conn)
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'ok': True})}
 
-    conn.close()
+    release(conn)
     return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'service': 'chats', 'status': 'ok'})}
\ No newline at end of file
@@ -0,0 +1,260 @@
+import json
+import hmac
+import os
+import time
+
+S = os.environ.get('MAIN_DB_SCHEMA', 'public')
+CALLS = f'"{S}".calls'
+ICE = f'"{S}".ice_candidates'
+ICE_EPHEMERAL = f'"{S}".ice_candidates_ephemeral'
+M = f'"{S}".messages'
+RL = f'"{S}".rate_limits'
+RS = f'"{S}".revoked_sessions'
+A = f'"{S}".attachments'
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+S3_BUCKET = os.environ.get('S3_BUCKET', 'files')
+ATTACHMENT_COMPLETE_TIMEOUT_SEC = int(os.environ.get('ATTACHMENT_COMPLETE_TIMEOUT_SEC', '900'))
+S3 = {}
+
+DEFAULTS = {
+    'batch_size': int(os.environ.get('MAINTENANCE_BATCH_SIZE', '500')),
+    'max_batches': int(os.environ.get('MAINTENANCE_MAX_BATCHES', '20')),
+    'pause_ms': int(os.environ.get('MAINTENANCE_PAUSE_MS', '50')),
+    'ring_timeout_sec': int(os.environ.get('CALL_RING_TIMEOUT_SEC', '120')),
+    'active_timeout_hours': int(os.environ.get('CALL_ACTIVE_TIMEOUT_HOURS', '6')),
+    'ice_ttl_minutes': int(os.environ.get('ICE_TTL_MINUTES', '10')),
+    'hidden_purge_days': int(os.environ.get('HIDDEN_PURGE_DAYS', '7')),
+    'rate_limit_ttl_minutes': int(os.environ.get('RATE_LIMIT_TTL_MINUTES', '60')),
+    'upload_ttl_hours': int(os.environ.get('ATTACHMENT_UPLOAD_TTL_HOURS', '24')),
+}
+# Верхние границы и для env, и для переопределений: один запуск не должен держать функцию и БД до таймаута
+LIMITS = {'batch_size': 5000, 'max_batches': 100, 'pause_ms': 1000}
+MAINTENANCE_TOKEN = os.environ.get('MAINTENANCE_TOKEN', '')
+
+def connect(url):
+    """psycopg2 импортируется при первом подключении, а не при загрузке модуля — быстрее холодный старт"""
+    import psycopg2
+    return psycopg2.connect(url)
+
+def get_db():
+    return connect(os.environ['DATABASE_URL'])
+
+def s3_client():
+    """boto3 импортируется и клиент создаётся один раз на тёплый инстанс, только если есть что чистить в S3"""
+    if 'client' not in S3:
+        import boto3
+        S3['client'] = boto3.client('s3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        )
+    return S3['client']
+
+def parse_body(event):
+    import base64 as b64
+    raw = event.get('body') or ''
+    if not raw or not raw.strip():
+        return {}
+    if event.get('isBase64Encoded'):
+        try:
+            raw = b64.b64decode(raw).decode('utf-8')
+        except Exception:
+            pass
+    try:
+        return json.loads(raw)
+    except Exception:
+        pass
+    try:
+        decoded = b64.b64decode(raw).decode('utf-8')
+        return json.loads(decoded)
+    except Exception:
+        return {}
+
+def run_batches(conn, sql, args, cfg):
+    """Выполняет sql пачками по batch_size, пока есть что обрабатывать или не исчерпан лимит пачек"""
+    cur = conn.cursor()
+    total = 0
+    batches = 0
+    while batches < cfg['max_batches']:
+        cur.execute(sql, args + (cfg['batch_size'],))
+        affected = cur.rowcount
+        conn.commit()
+        total += affected
+        batches += 1
+        if affected < cfg['batch_size']:
+            break
+        if cfg['pause_ms']:
+            time.sleep(cfg['pause_ms'] / 1000)
+    return {'rows': total, 'batches': batches}
+
+def timeout_ringing_calls(conn, cfg):
+    return run_batches(conn, f"""
+        UPDATE {CALLS} SET status = 'missed', ended_at = now()
+        WHERE id IN (
+            SELECT id FROM {CALLS}
+            WHERE status = 'ringing' AND created_at < now() - make_interval(secs => %s)
+            LIMIT %s
+        )
+    """, (cfg['ring_timeout_sec'],), cfg)
+
+def timeout_active_calls(conn, cfg):
+    return run_batches(conn, f"""
+        UPDATE {CALLS} SET status = 'ended', ended_at = now()
+        WHERE id IN (
+            SELECT id FROM {CALLS}
+            WHERE status = 'active' AND COALESCE(answered_at, created_at) < now() - make_interval(hours => %s)
+            LIMIT %s
+        )
+    """, (cfg['active_timeout_hours'],), cfg)
+
+def delete_old_ice(conn, cfg, table=ICE):
+    return run_batches(conn, f"""
+        DELETE FROM {table}
+        WHERE id IN (
+            SELECT id FROM {table}
+            WHERE created_at < now() - make_interval(mins => %s)
+            LIMIT %s
+        )
+    """, (cfg['ice_ttl_minutes'],), cfg)
+
+def delete_old_ephemeral_ice(conn, cfg):
+    return delete_old_ice(conn, cfg, ICE_EPHEMERAL)
+
+def purge_hidden_messages(conn, cfg):
+    return run_batches(conn, f"""
+        UPDATE {M} SET text = ''
+        WHERE id IN (
+            SELECT id FROM {M}
+            WHERE hidden_for_all = true AND text <> '' AND hidden_at < now() - make_interval(days => %s)
+            LIMIT %s
+        )
+    """, (cfg['hidden_purge_days'],), cfg)
+
+def delete_idle_rate_limits(conn, cfg):
+    return run_batches(conn, f"""
+        DELETE FROM {RL}
+        WHERE (user_id, action) IN (
+            SELECT user_id, action FROM {RL}
+            WHERE updated_at < now() - make_interval(mins => %s)
+            LIMIT %s
+        )
+    """, (cfg['rate_limit_ttl_minutes'],), cfg)
+
+def delete_expired_revocations(conn, cfg):
+    return run_batches(conn, f"""
+        DELETE FROM {RS}
+        WHERE jti IN (
+            SELECT jti FROM {RS}
+            WHERE expires_at < now()
+            LIMIT %s
+        )
+    """, (), cfg)
+
+def abort_stale_uploads(conn, cfg):
+    """Незавершённые загрузки вложений старше upload_ttl_hours: multipart upload в S3 отменяется, собранный, но не
+    проверенный объект удаляется, строки удаляются. Такие вложения ещё не могли попасть в сообщения — send принимает
+    только загруженные. Загрузки, которые прямо сейчас завершает complete, не трогаются"""
+    cur = conn.cursor()
+    total = 0
+    batches = 0
+    while batches < cfg['max_batches']:
+        cur.execute(f"""
+            SELECT id, upload_key, upload_id FROM {A}
+            WHERE sha256 IS NULL AND created_at < now() - make_interval(hours => %s)
+              AND (completing_at IS NULL OR completing_at < now() - make_interval(secs => %s))
+            ORDER BY created_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        """, (cfg['upload_ttl_hours'], ATTACHMENT_COMPLETE_TIMEOUT_SEC, cfg['batch_size']))
+        rows = cur.fetchall()
+        for attachment_id, key, upload_id in rows:
+            try:
+                if upload_id:
+                    s3_client().abort_multipart_upload(Bucket=S3_BUCKET, Key=key, UploadId=upload_id)
+                else:
+                    s3_client().delete_object(Bucket=S3_BUCKET, Key=key)
+            except Exception as e:
+                print(f"[MAINTENANCE] abort upload {attachment_id}: {e}")
+        cur.execute(f"DELETE FROM {A} WHERE id = ANY(%s::uuid[])", ([str(r[0]) for r in rows],))
+        conn.commit()
+        total += len(rows)
+        batches += 1
+        if len(rows) < cfg['batch_size']:
+            break
+        if cfg['pause_ms']:
+            time.sleep(cfg['pause_ms'] / 1000)
+    return {'rows': total, 'batches': batches}
+
+JOBS = {
+    'calls_ringing': timeout_ringing_calls,
+    'calls_active': timeout_active_calls,
+    'ice': delete_old_ice,
+    'ice_ephemeral': delete_old_ephemeral_ice,
+    'hidden_messages': purge_hidden_messages,
+    'rate_limits': delete_idle_rate_limits,
+    'revoked_sessions': delete_expired_revocations,
+    'attachment_uploads': abort_stale_uploads,
+}
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-Maintenance-Token', 'Access-Control-Max-Age': '86400'}
+HEADERS = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+
+def handler(event, context):
+    """Фоновое обслуживание Того — таймаут звонков, очистка ICE-кандидатов и скрытых сообщений"""
+    if event.get('httpMethod') == 'OPTIONS':
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
+
+    headers = HEADERS
+    params = event.get('queryStringParameters', {}) or {}
+    body = parse_body(event)
+    action = params.get('action', '') or body.get('action', '')
+    req_headers = event.get('headers', {}) or {}
+
+    if action == 'run':
+        cfg = dict(DEFAULTS)
+        overridden = []
+        for key in cfg:
+            value = params.get(key, '') or body.get(key, '')
+            if value != '':
+                try:
+                    cfg[key] = max(0, int(value))
+                except (TypeError, ValueError):
+                    return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'{key} must be an integer'})}
+                overridden.append(key)
+        for key, limit in LIMITS.items():
+            cfg[key] = min(cfg[key], limit)
+        if cfg['batch_size'] < 1 or cfg['max_batches'] < 1:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'batch_size and max_batches must be positive'})}
+
+        jobs_param = params.get('jobs', '') or body.get('jobs', '')
+        if isinstance(jobs_param, str):
+            jobs_param = [j.strip() for j in jobs_param.split(',') if j.strip()]
+        job_names = jobs_param or list(JOBS)
+        unknown = [j for j in job_names if j not in JOBS]
+        if unknown:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'Unknown jobs: {", ".join(unknown)}'})}
+
+        # С заданным MAINTENANCE_TOKEN без него не запустить даже run по умолчанию; пороги вроде ring_timeout_sec=0
+        # завершили бы все звонки, поэтому без секрета переопределения не принимаются никогда
+        token = req_headers.get('x-maintenance-token', '')
+        authorized = bool(MAINTENANCE_TOKEN) and hmac.compare_digest(token, MAINTENANCE_TOKEN)
+        if MAINTENANCE_TOKEN and not authorized:
+            return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': 'X-Maintenance-Token required'})}
+        if overridden and not authorized:
+            return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': f'X-Maintenance-Token required to override {", ".join(overridden)}'})}
+
+        conn = get_db()
+        results = {}
+        started = time.monotonic()
+        for name in job_names:
+            results[name] = JOBS[name](conn, cfg)
+        conn.close()
+
+        print(f"[MAINTENANCE] {results}")
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
+            'ok': True,
+            'jobs': results,
+            'elapsed_ms': int((time.monotonic() - started) * 1000),
+        })}
+
+    return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'service': 'maintenance', 'status': 'ok'})}
@@ -1,15 +1,309 @@
 import json
+import base64
+import hmac
+import hashlib
 import os
-import psycopg2
-from datetime import datetime
+import math
+import time
+from datetime import datetime, timezone
 
 S = os.environ.get('MAIN_DB_SCHEMA', 'public')
 U = f'"{S}".users'
 M = f'"{S}".messages'
 CM = f'"{S}".chat_members'
+RL = f'"{S}".rate_limits'
+RS = f'"{S}".revoked_sessions'
+A = f'"{S}".attachments'
+AB = f'"{S}".attachment_blobs'
+MA = f'"{S}".message_attachments'
 
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+ATTACHMENTS_JSON = f"""(
+        SELECT json_agg(json_build_object('id', a.id, 'name', a.name, 'mime', a.mime, 'size', b.size, 'sha256', b.sha256, 'url', b.url) ORDER BY ma.position)
+        FROM {MA} ma JOIN {A} a ON a.id = ma.attachment_id JOIN {AB} b ON b.sha256 = a.sha256
+        WHERE ma.message_id = m.id
+    )"""
+
+MESSAGES_AFTER_SQL = f"""
+    SELECT m.id, m.chat_id, m.sender_id, m.text, m.status, m.created_at, u.display_name, u.avatar, {ATTACHMENTS_JSON}
+    FROM {M} m JOIN {U} u ON u.id = m.sender_id
+    WHERE m.chat_id = %s::uuid AND m.created_at > %s::timestamp
+      AND m.hidden_for_all = false
+      AND (m.hidden_by IS NULL OR m.hidden_by != %s::uuid OR m.sender_id = %s::uuid)
+    ORDER BY m.created_at ASC LIMIT %s
+"""
+
+MESSAGES_LATEST_SQL = f"""
+    SELECT m.id, m.chat_id, m.sender_id, m.text, m.status, m.created_at, u.display_name, u.avatar, {ATTACHMENTS_JSON}
+    FROM {M} m JOIN {U} u ON u.id = m.sender_id
+    WHERE m.chat_id = %s::uuid
+      AND m.hidden_for_all = false
+      AND (m.hidden_by IS NULL OR m.hidden_by != %s::uuid OR m.sender_id = %s::uuid)
+    ORDER BY m.created_at DESC LIMIT %s
+"""
+
+SEARCH_SQL_TEMPLATE = f"""
+    SELECT m.id, m.chat_id, m.sender_id, m.text, m.status, m.created_at, u.display_name, u.avatar,
+           ts_rank(m.search_tsv, q.query) AS rank
+    FROM (SELECT websearch_to_tsquery('russian', %s) || websearch_to_tsquery('english', %s) AS query) q
+    JOIN {M} m ON m.search_tsv @@ q.query
+    JOIN {CM} cm ON cm.chat_id = m.chat_id AND cm.user_id = %s::uuid AND cm.left_at IS NULL
+    JOIN {U} u ON u.id = m.sender_id
+    WHERE m.hidden_for_all = false
+      AND (m.hidden_by IS NULL OR m.hidden_by != %s::uuid OR m.sender_id = %s::uuid)
+      {{chat_filter}}
+    ORDER BY rank DESC, m.created_at DESC
+    LIMIT %s OFFSET %s
+"""
+SEARCH_SQL = SEARCH_SQL_TEMPLATE.format(chat_filter='')
+SEARCH_IN_CHAT_SQL = SEARCH_SQL_TEMPLATE.format(chat_filter='AND m.chat_id = %s::uuid')
+
+POLL_SQL = f"""
+    SELECT m.id, m.chat_id, m.sender_id, m.text, m.status, m.created_at, u.display_name, u.avatar, {ATTACHMENTS_JSON}
+    FROM {M} m
+    JOIN {U} u ON u.id = m.sender_id
+    JOIN {CM} cm ON cm.chat_id = m.chat_id AND cm.user_id = %s::uuid AND cm.left_at IS NULL
+    WHERE m.created_at > %s::timestamp AND m.sender_id != %s::uuid
+      AND m.hidden_for_all = false
+    ORDER BY m.created_at ASC LIMIT 100
+"""
+
+# Прикрепить можно свои загруженные файлы или файлы из сообщений видимых чатов (пересылка) — без повторной загрузки
+ATTACH_SQL = f"""
+    INSERT INTO {MA} (message_id, attachment_id, position)
+    SELECT %s::uuid, a.id, array_position(%s::uuid[], a.id) - 1
+    FROM {A} a JOIN {AB} b ON b.sha256 = a.sha256
+    WHERE a.id = ANY(%s::uuid[])
+      AND (a.owner_id = %s::uuid OR EXISTS (
+          SELECT 1 FROM {MA} fma
+          JOIN {M} fm ON fm.id = fma.message_id AND fm.hidden_for_all = false
+          JOIN {CM} cm ON cm.chat_id = fm.chat_id AND cm.user_id = %s::uuid AND cm.left_at IS NULL
+          WHERE fma.attachment_id = a.id
+      ))
+"""
+ATTACHMENTS_PER_MESSAGE = 10
+
+CHAT_CURSORS_SQL = f"""
+    SELECT MIN(COALESCE(delivered_up_to, 'epoch')), MIN(COALESCE(read_up_to, 'epoch'))
+    FROM {CM}
+    WHERE chat_id = %s::uuid AND user_id != %s::uuid AND left_at IS NULL
+"""
+
+RECEIPTS_SQL = f"""
+    SELECT o.chat_id, MIN(COALESCE(o.delivered_up_to, 'epoch')), MIN(COALESCE(o.read_up_to, 'epoch'))
+    FROM {CM} me
+    JOIN {CM} o ON o.chat_id = me.chat_id AND o.user_id != me.user_id AND o.left_at IS NULL
+    WHERE me.user_id = %s::uuid AND me.left_at IS NULL
+    GROUP BY o.chat_id
+    HAVING MIN(COALESCE(o.delivered_up_to, 'epoch')) >= %s::timestamp
+"""
+
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'postgres')
+RATE_LIMITS = {'send': (30, 1.0), 'sync': (10, 0.2), 'search': (20, 0.5)}
+# Пакет sync списывает из бакета send по токену на сообщение, поэтому больше его ёмкости не принимается
+SYNC_MAX_MESSAGES = RATE_LIMITS['send'][0]
+BUCKETS = {}
+
+POLL_MIN_MS = int(os.environ.get('POLL_MIN_MS', '1000'))
+POLL_MAX_MS = int(os.environ.get('POLL_MAX_MS', '10000'))
+POLL_IDLE_STEP_MS = int(os.environ.get('POLL_IDLE_STEP_MS', '50'))
+
+SESSION_KEYS = {
+    kid: secret.encode()
+    for kid, _, secret in (item.strip().partition(':') for item in os.environ.get('SESSION_KEYS', '').split(','))
+    if kid and secret
+}
+AUTH_MODE = os.environ.get('AUTH_MODE', 'legacy')
+REVOCATION_CACHE_SEC = int(os.environ.get('REVOCATION_CACHE_SEC', '30'))
+REVOKED = {'jtis': set(), 'loaded_at': 0.0}
+
+PREPARED_STATEMENTS = os.environ.get('PREPARED_STATEMENTS', '1') == '1'
+CONN_MAX_IDLE_SEC = int(os.environ.get('CONN_MAX_IDLE_SEC', '60'))
+CONNECTIONS = {}
+
+def connect(url):
+    """psycopg2 импортируется при первом подключении, а не при загрузке модуля — быстрее холодный старт.
+    С PREPARED_STATEMENTS тёплый инстанс держит по соединению на URL, чтобы подготовленные запросы жили между вызовами"""
+    import psycopg2
+    import psycopg2.extensions
+    if not PREPARED_STATEMENTS:
+        return psycopg2.connect(url)
+    now = time.time()
+    cached = CONNECTIONS.get(url)
+    if cached and not cached['conn'].closed and now - cached['used_at'] < CONN_MAX_IDLE_SEC:
+        cached['used_at'] = now
+        if cached['conn'].get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            cached['conn'].rollback()
+        return cached['conn']
+    if cached and not cached['conn'].closed:
+        cached['conn'].close()
+    conn = psycopg2.connect(url)
+    CONNECTIONS[url] = {'conn': conn, 'prepared': set(), 'used_at': now}
+    return conn
+
+def release(conn):
+    """Переиспользуемое соединение только откатывает незавершённую транзакцию, остальные закрываются"""
+    if PREPARED_STATEMENTS and not conn.closed:
+        conn.rollback()
+    else:
+        conn.close()
+
+def to_positional(sql):
+    parts = sql.split('%s')
+    return ''.join(part + (f'${i + 1}' if i < len(parts) - 1 else '') for i, part in enumerate(parts))
+
+def execute(cur, name, sql, args):
+    """Горячий запрос: PREPARE один раз на соединение, дальше EXECUTE — Postgres не разбирает и не планирует его заново.
+    Если сервер закрыл сохранённое соединение (рестарт, failover, idle-таймаут), оно открывается заново и запрос
+    повторяется один раз. Возвращает курсор, из которого читать результат"""
+    import psycopg2
+    entry = next((c for c in CONNECTIONS.values() if c['conn'] is cur.connection), None)
+    if not PREPARED_STATEMENTS or entry is None:
+        cur.execute(sql, args)
+        return cur
+    try:
+        execute_prepared(cur, entry, name, sql, args)
+    except psycopg2.OperationalError:
+        if not cur.connection.closed:
+            raise
+        url = next(u for u, c in CONNECTIONS.items() if c is entry)
+        del CONNECTIONS[url]
+        cur = connect(url).cursor()
+        execute_prepared(cur, CONNECTIONS[url], name, sql, args)
+    return cur
+
+def execute_prepared(cur, entry, name, sql, args):
+    if name not in entry['prepared']:
+        cur.execute(f'PREPARE {name} AS {to_positional(sql)}')
+        entry['prepared'].add(name)
+    cur.execute(f'EXECUTE {name} ({", ".join(["%s"] * len(args))})', args)
+
+READ_ACTIONS = {'list', 'poll', 'search'}
+# ack пишет только курсор доставки — на то, что пользователь прочитает следом, он не влияет, и на primary его не держит
+CURSOR_ACTIONS = {'ack'}
+READ_AFTER_WRITE_SEC = float(os.environ.get('READ_AFTER_WRITE_SEC', '5'))
+LAST_WRITE = {}
+
+def get_db(action='', user_id='', req_headers=None):
+    """Read-only действия идут на DATABASE_READ_URL, если пользователь недавно ничего не писал; остальное — на primary"""
+    now = time.time()
+    read_url = os.environ.get('DATABASE_READ_URL', '')
+    if action in READ_ACTIONS:
+        if read_url and not wrote_recently(user_id, req_headers or {}, now):
+            return connect(read_url)
+    elif action and user_id and action not in CURSOR_ACTIONS:
+        if len(LAST_WRITE) > 10000:
+            for uid in [u for u, t in LAST_WRITE.items() if now - t >= READ_AFTER_WRITE_SEC]:
+                del LAST_WRITE[uid]
+        LAST_WRITE[user_id] = now
+    return connect(os.environ['DATABASE_URL'])
+
+def wrote_recently(user_id, req_headers, now):
+    """X-Last-Write — сколько мс назад клиент сделал запись (возраст, а не время: не зависит от часов клиента)"""
+    if user_id and now - LAST_WRITE.get(user_id, 0) < READ_AFTER_WRITE_SEC:
+        return True
+    try:
+        return float(req_headers.get('x-last-write', '')) / 1000 < READ_AFTER_WRITE_SEC
+    except ValueError:
+        return False
+
+def take_token(conn, user_id, action, cost=1):
+    """Токен-бакет на пару (пользователь, действие): 0 — запрос разрешён, иначе через сколько секунд повторить.
+    cost — сколько токенов списать (sync платит за каждое сообщение пакета)"""
+    if action not in RATE_LIMITS or not user_id or RATE_LIMIT_BACKEND == 'off':
+        return 0
+    capacity, per_sec = RATE_LIMITS[action]
+    if RATE_LIMIT_BACKEND == 'memory':
+        now = time.monotonic()
+        tokens, updated_at = BUCKETS.get((user_id, action), (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * per_sec)
+        if tokens < cost:
+            BUCKETS[(user_id, action)] = (tokens, now)
+            return (cost - tokens) / per_sec
+        BUCKETS[(user_id, action)] = (tokens - cost, now)
+        return 0
+
+    own_conn = conn is None
+    if own_conn:
+        conn = connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    cur.execute(f"""
+        INSERT INTO {RL} AS rl (user_id, action, tokens, updated_at) VALUES (%s, %s, %s - %s, now())
+        ON CONFLICT (user_id, action) DO UPDATE
+        SET tokens = LEAST(%s, rl.tokens + EXTRACT(EPOCH FROM now() - rl.updated_at) * %s) - %s, updated_at = now()
+        WHERE LEAST(%s, rl.tokens + EXTRACT(EPOCH FROM now() - rl.updated_at) * %s) >= %s
+        RETURNING tokens
+    """, (user_id, action, capacity, cost, capacity, per_sec, cost, capacity, per_sec, cost))
+    allowed = cur.fetchone() is not None
+    conn.commit()
+    if own_conn:
+        release(conn)
+    return 0 if allowed else cost / per_sec
+
+def too_many_requests(headers, retry_after):
+    return {'statusCode': 429, 'headers': {**headers, 'Retry-After': str(math.ceil(retry_after))}, 'body': json.dumps({'error': 'Слишком много запросов, попробуйте позже', 'retry_after': round(retry_after, 1)})}
+
+def next_poll_after(after, has_messages):
+    """Подсказка клиенту, через сколько мс опрашивать снова: растёт с простоем с момента after, сбрасывается при новых сообщениях"""
+    if has_messages:
+        return POLL_MIN_MS
+    try:
+        last = datetime.fromisoformat(after.replace('Z', '+00:00'))
+    except ValueError:
+        return POLL_MIN_MS
+    if last.tzinfo:
+        last = last.astimezone(timezone.utc).replace(tzinfo=None)
+    idle_sec = max(0, (datetime.utcnow() - last).total_seconds())
+    return int(min(POLL_MAX_MS, POLL_MIN_MS + idle_sec * POLL_IDLE_STEP_MS))
+
+def b64url_decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def verify_session(token):
+    """Токен kid.payload.signature (HMAC-SHA256) проверяется в процессе, без запроса к БД; возвращает claims или None"""
+    try:
+        kid, payload, signature = token.split('.')
+        key = SESSION_KEYS.get(kid)
+        if not key:
+            return None
+        expected = hmac.new(key, f'{kid}.{payload}'.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, b64url_decode(signature)):
+            return None
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(claims, dict) or not claims.get('uid') or claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+def authenticate(req_headers, fallback_user_id, action):
+    """user_id из X-Auth-Token; без токена в AUTH_MODE=legacy — как раньше из x-user-id/body/query. None — отказать с 401"""
+    token = req_headers.get('x-auth-token', '')
+    if token:
+        claims = verify_session(token)
+        return (claims['uid'], claims) if claims else (None, None)
+    if AUTH_MODE == 'token' and action:
+        return None, None
+    return fallback_user_id, None
+
+def is_revoked(conn, claims):
+    """Список отозванных сессий кешируется в процессе на REVOCATION_CACHE_SEC; без conn используется кеш как есть"""
+    now = time.time()
+    if conn is not None and now - REVOKED['loaded_at'] > REVOCATION_CACHE_SEC:
+        cur = conn.cursor()
+        cur.execute(f"SELECT jti FROM {RS} WHERE expires_at > now()")
+        REVOKED['jtis'] = {r[0] for r in cur.fetchall()}
+        REVOKED['loaded_at'] = now
+    return claims.get('jti') in REVOKED['jtis']
+
+def unauthorized(headers):
+    return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Требуется авторизация'})}
+
+def receipt_status(created_at, delivered_up_to, read_up_to):
+    if created_at <= read_up_to:
+        return 'read'
+    if created_at <= delivered_up_to:
+        return 'delivered'
+    return 'sent'
 
 def parse_body(event):
     import base64 as b64
@@ -31,38 +325,66 @@ def parse_body(event):
     except Exception:
         return {}
 
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id, X-Last-Write', 'Access-Control-Max-Age': '86400'}
+HEADERS = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+
 def handler(event, context):
     """Отправка и получение сообщений в чатах Того"""
     if event.get('httpMethod') == 'OPTIONS':
-        return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Session-Id', 'Access-Control-Max-Age': '86400'}, 'body': ''}
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
-    headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+    headers = HEADERS
     method = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters', {}) or {}
     body = parse_body(event)
     action = params.get('action', '') or body.get('action', '')
-    req_headers = event.get('headers', {})
-    user_id = req_headers.get('x-user-id', '') or body.get('user_id', '') or params.get('user_id', '')
+    req_headers = event.get('headers', {}) or {}
+    user_id, claims = authenticate(req_headers, req_headers.get('x-user-id', '') or body.get('user_id', '') or params.get('user_id', ''), action)
+    if user_id is None:
+        return unauthorized(headers)
 
-    conn = get_db()
+    conn = get_db(action, user_id, req_headers)
     cur = conn.cursor()
 
+    if claims and is_revoked(conn, claims):
+        release(conn)
+        return unauthorized(headers)
+
     if method == 'POST' and action == 'send':
         chat_id = body.get('chat_id', '')
         text = body.get('text', '').strip()
         client_id = body.get('client_id', '')
+        attachment_ids = body.get('attachment_ids', [])
+        if not isinstance(attachment_ids, list) or len(attachment_ids) > ATTACHMENTS_PER_MESSAGE:
+            release(conn)
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'attachment_ids must be a list of up to {ATTACHMENTS_PER_MESSAGE} ids'})}
+        attachment_ids = list(dict.fromkeys(str(a) for a in attachment_ids))
 
-        if not user_id or not chat_id or not text:
-            conn.close()
-            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id, chat_id and text required'})}
+        if not user_id or not chat_id or not (text or attachment_ids):
+            release(conn)
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id, chat_id and text or attachment_ids required'})}
+
+        retry_after = take_token(conn, user_id, 'send')
+        if retry_after:
+            release(conn)
+            return too_many_requests(headers, retry_after)
 
         cur.execute(
             f"INSERT INTO {M} (chat_id, sender_id, text, status) VALUES (%s::uuid, %s::uuid, %s, 'sent') RETURNING id, created_at",
             (chat_id, user_id, text)
         )
         row = cur.fetchone()
+        attachments = []
+        if attachment_ids:
+            cur.execute(ATTACH_SQL, (row[0], attachment_ids, attachment_ids, user_id, user_id))
+            if cur.rowcount != len(attachment_ids):
+                conn.rollback()
+                release(conn)
+                return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'Вложение не найдено или ещё не загружено'})}
+            cur.execute(f"SELECT {ATTACHMENTS_JSON} FROM {M} m WHERE m.id = %s::uuid", (row[0],))
+            attachments = cur.fetchone()[0]
         conn.commit()
-        conn.close()
+        release(conn)
 
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
             'id': str(row[0]),
@@ -72,6 +394,7 @@ def handler(event, context):
             'text': text,
             'status': 'sent',
             'created_at': row[1].isoformat(),
+            'attachments': attachments,
         })}
 
     if action == 'list':
@@ -80,50 +403,51 @@ def handler(event, context):
         limit = int(params.get('limit', '50'))
 
         if not chat_id:
-            conn.close()
+            release(conn)
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'chat_id required'})}
 
         uid_filter = user_id or '00000000-0000-0000-0000-000000000000'
         if after:
-            cur.execute(f"""
-                SELECT m.id, m.chat_id, m.sender_id, m.text, m.status, m.created_at, u.display_name, u.avatar
-                FROM {M} m JOIN {U} u ON u.id = m.sender_id
-                WHERE m.chat_id = %s::uuid AND m.created_at > %s::timestamp
-                  AND m.hidden_for_all = false
-                  AND (m.hidden_by IS NULL OR m.hidden_by != %s::uuid OR m.sender_id = %s::uuid)
-                ORDER BY m.created_at ASC LIMIT %s
-            """, (chat_id, after, uid_filter, uid_filter, limit))
+            cur = execute(cur, 'messages_after', MESSAGES_AFTER_SQL, (chat_id, after, uid_filter, uid_filter, limit))
         else:
-            cur.execute(f"""
-                SELECT m.id, m.chat_id, m.sender_id, m.text, m.status, m.created_at, u.display_name, u.avatar
-                FROM {M} m JOIN {U} u ON u.id = m.sender_id
-                WHERE m.chat_id = %s::uuid
-                  AND m.hidden_for_all = false
-                  AND (m.hidden_by IS NULL OR m.hidden_by != %s::uuid OR m.sender_id = %s::uuid)
-                ORDER BY m.created_at DESC LIMIT %s
-            """, (chat_id, uid_filter, uid_filter, limit))
+            cur = execute(cur, 'messages_latest', MESSAGES_LATEST_SQL, (chat_id, uid_filter, uid_filter, limit))
 
         rows = cur.fetchall()
         if not after:
             rows = list(reversed(rows))
 
+        delivered_up_to = read_up_to = None
+        if user_id and any(str(r[2]) == user_id for r in rows):
+            cur = execute(cur, 'chat_cursors', CHAT_CURSORS_SQL, (chat_id, user_id))
+            delivered_up_to, read_up_to = cur.fetchone()
+
         messages = [{
             'id': str(r[0]),
             'chat_id': str(r[1]),
             'sender_id': str(r[2]),
             'text': r[3],
-            'status': r[4],
+            'status': receipt_status(r[5], delivered_up_to, read_up_to) if delivered_up_to and str(r[2]) == user_id else r[4],
             'created_at': r[5].isoformat(),
             'sender_name': r[6],
             'sender_avatar': r[7],
+            'attachments': r[8] or [],
         } for r in rows]
 
-        conn.close()
+        release(cur.connection)
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'messages': messages})}
 
     if method == 'POST' and action == 'sync':
         msgs = body.get('messages', [])
         results = []
+        if not isinstance(msgs, list) or len(msgs) > SYNC_MAX_MESSAGES:
+            release(conn)
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': f'messages must be a list of up to {SYNC_MAX_MESSAGES} items'})}
+        retry_after = take_token(conn, user_id, 'sync')
+        if not retry_after and msgs:
+            retry_after = take_token(conn, user_id, 'send', len(msgs))
+        if retry_after:
+            release(conn)
+            return too_many_requests(headers, retry_after)
         for msg in msgs:
             chat_id = msg.get('chat_id', '')
             text = msg.get('text', '').strip()
@@ -136,25 +460,17 @@ def handler(event, context):
                 row = cur.fetchone()
                 results.append({'id': str(row[0]), 'client_id': client_id, 'status': 'sent', 'created_at': row[1].isoformat()})
         conn.commit()
-        conn.close()
+        release(conn)
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'results': results})}
 
     if action == 'poll':
         after = params.get('after', '') or body.get('after', '')
 
         if not user_id or not after:
-            conn.close()
-            return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'messages': []})}
-
-        cur.execute(f"""
-            SELECT m.id, m.chat_id, m.sender_id, m.text, m.status, m.created_at, u.display_name, u.avatar
-            FROM {M} m
-            JOIN {U} u ON u.id = m.sender_id
-            JOIN {CM} cm ON cm.chat_id = m.chat_id AND cm.user_id = %s::uuid AND cm.left_at IS NULL
-            WHERE m.created_at > %s::timestamp AND m.sender_id != %s::uuid
-              AND m.hidden_for_all = false
-            ORDER BY m.created_at ASC LIMIT 100
-        """, (user_id, after, user_id))
+            release(conn)
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'messages': [], 'next_poll_after': POLL_MIN_MS})}
+
+        cur = execute(cur, 'messages_poll', POLL_SQL, (user_id, after, user_id))
 
         messages = [{
             'id': str(r[0]),
@@ -165,23 +481,118 @@ def handler(event, context):
             'created_at': r[5].isoformat(),
             'sender_name': r[6],
             'sender_avatar': r[7],
+            'attachments': r[8] or [],
         } for r in cur.fetchall()]
 
-        conn.close()
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'messages': messages})}
+        result = {'messages': messages, 'next_poll_after': next_poll_after(after, bool(messages))}
+        receipts_since = params.get('receipts_since', '') or body.get('receipts_since', '')
+        if receipts_since:
+            cur = execute(cur, 'messages_receipts', RECEIPTS_SQL, (user_id, receipts_since))
+            result['receipts'] = [{
+                'chat_id': str(r[0]),
+                'delivered_up_to': r[1].isoformat(),
+                'read_up_to': r[2].isoformat(),
+            } for r in cur.fetchall()]
+
+        release(cur.connection)
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps(result)}
+
+    if method == 'POST' and action == 'ack':
+        up_to = body.get('up_to', '')
+        message_ids = body.get('message_ids', [])
+
+        if not isinstance(message_ids, list) or len(message_ids) > 500:
+            release(conn)
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'message_ids must be a list of up to 500 ids'})}
+        if not user_id or not (up_to or message_ids):
+            release(conn)
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id and up_to or message_ids required'})}
+
+        if up_to:
+            # Двигаются только курсоры чатов, где после прошлого ack пришли чужие сообщения (до up_to включительно),
+            # и только до последнего из них; время клиента из будущего ограничивается now()
+            cur.execute(f"""
+                UPDATE {CM} cm SET delivered_up_to = x.up_to
+                FROM (
+                    SELECT m.chat_id, MAX(m.created_at) AS up_to
+                    FROM {M} m
+                    JOIN {CM} me ON me.chat_id = m.chat_id AND me.user_id = %s::uuid AND me.left_at IS NULL
+                    WHERE m.created_at > COALESCE(me.delivered_up_to, 'epoch')
+                      AND m.created_at <= LEAST(%s::timestamp, now())
+                      AND m.sender_id != %s::uuid
+                    GROUP BY m.chat_id
+                ) x
+                WHERE cm.chat_id = x.chat_id AND cm.user_id = %s::uuid
+            """, (user_id, up_to, user_id, user_id))
+        else:
+            cur.execute(f"""
+                UPDATE {CM} cm SET delivered_up_to = x.up_to
+                FROM (
+                    SELECT chat_id, MAX(created_at) AS up_to FROM {M}
+                    WHERE id = ANY(%s::uuid[]) AND sender_id != %s::uuid
+                    GROUP BY chat_id
+                ) x
+                WHERE cm.chat_id = x.chat_id AND cm.user_id = %s::uuid AND cm.left_at IS NULL
+                  AND (cm.delivered_up_to IS NULL OR cm.delivered_up_to < x.up_to)
+            """, ([str(i) for i in message_ids], user_id, user_id))
+        updated = cur.rowcount
+        conn.commit()
+        release(conn)
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'ok': True, 'chats': updated})}
+
+    if action == 'search':
+        query = (params.get('q', '') or body.get('q', '')).strip()
+        chat_id = params.get('chat_id', '') or body.get('chat_id', '')
+        try:
+            limit = min(50, max(1, int(params.get('limit', '') or body.get('limit', '') or 20)))
+            offset = max(0, int(params.get('offset', '') or body.get('offset', '') or 0))
+        except (TypeError, ValueError):
+            release(conn)
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'limit and offset must be integers'})}
+
+        if not user_id or len(query) < 2:
+            release(conn)
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id and q (2+ chars) required'})}
+
+        retry_after = take_token(None if os.environ.get('DATABASE_READ_URL') else conn, user_id, 'search')
+        if retry_after:
+            release(conn)
+            return too_many_requests(headers, retry_after)
+
+        args = [query, query, user_id, user_id, user_id] + ([chat_id] if chat_id else []) + [limit + 1, offset]
+        cur.execute(SEARCH_IN_CHAT_SQL if chat_id else SEARCH_SQL, args)
+        rows = cur.fetchall()
+        release(conn)
+
+        messages = [{
+            'id': str(r[0]),
+            'chat_id': str(r[1]),
+            'sender_id': str(r[2]),
+            'text': r[3],
+            'status': r[4],
+            'created_at': r[5].isoformat(),
+            'sender_name': r[6],
+            'sender_avatar': r[7],
+            'rank': round(r[8], 4),
+        } for r in rows[:limit]]
+
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
+            'messages': messages,
+            'next_offset': offset + limit if len(rows) > limit else None,
+        })}
 
     if method == 'POST' and action == 'delete_message':
         msg_id = body.get('msg_id', '')
         delete_for_all = body.get('for_all', False)
 
         if not user_id or not msg_id:
-            conn.close()
+            release(conn)
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id and msg_id required'})}
 
         cur.execute(f"SELECT sender_id, created_at FROM {M} WHERE id = %s::uuid", (msg_id,))
         row = cur.fetchone()
         if not row:
-            conn.close()
+            release(conn)
             return {'statusCode': 404, 'headers': headers, 'body': json.dumps({'error': 'Message not found'})}
 
         sender_id = str(row[0])
@@ -190,29 +601,29 @@ def handler(event, context):
 
         if delete_for_all:
             if sender_id != user_id:
-                conn.close()
+                release(conn)
                 return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': 'Только автор может удалить для всех'})}
             if age_hours > 24:
-                conn.close()
+                release(conn)
                 return {'statusCode': 403, 'headers': headers, 'body': json.dumps({'error': 'Можно удалить для всех только в течение 24 часов'})}
             cur.execute(f"UPDATE {M} SET hidden_for_all = true, hidden_at = now(), hidden_by = %s::uuid WHERE id = %s::uuid", (user_id, msg_id))
         else:
             cur.execute(f"UPDATE {M} SET hidden_by = %s::uuid WHERE id = %s::uuid AND hidden_by IS NULL", (user_id, msg_id))
 
         conn.commit()
-        conn.close()
+        release(conn)
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'ok': True, 'msg_id': msg_id, 'for_all': delete_for_all})}
 
     if method == 'POST' and action == 'leave_chat':
         chat_id = body.get('chat_id', '')
         if not user_id or not chat_id:
-            conn.close()
+            release(conn)
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id and chat_id required'})}
 
         cur.execute(f"UPDATE {CM} SET left_at = now() WHERE chat_id = %s::uuid AND user_id = %s::uuid AND left_at IS NULL", (chat_id, user_id))
         conn.commit()
-        conn.close()
+        release(conn)
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'ok': True})}
 
-    conn.close()
+    release(conn)
     return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'service': 'messages', 'status': 'ok'})}
\ No newline at end of file
@@ -1,16 +1,108 @@
 import json
+import hmac
+import hashlib
 import os
-import psycopg2
+import time
 import base64
-import boto3
-import uuid
 
 S = os.environ.get('MAIN_DB_SCHEMA', 'public')
 U = f'"{S}".users'
 ST = f'"{S}".statuses'
+RS = f'"{S}".revoked_sessions'
+
+STATUSES_LIST_SQL = f"""
+    SELECT s.id, s.user_id, s.type, s.content, s.image_url, s.created_at,
+           u.display_name, u.avatar
+    FROM {ST} s
+    JOIN {U} u ON u.id = s.user_id
+    WHERE s.expires_at > now()
+    ORDER BY s.created_at DESC
+    LIMIT 200
+"""
+
+SESSION_KEYS = {
+    kid: secret.encode()
+    for kid, _, secret in (item.strip().partition(':') for item in os.environ.get('SESSION_KEYS', '').split(','))
+    if kid and secret
+}
+AUTH_MODE = os.environ.get('AUTH_MODE', 'legacy')
+REVOCATION_CACHE_SEC = int(os.environ.get('REVOCATION_CACHE_SEC', '30'))
+REVOKED = {'jtis': set(), 'loaded_at': 0.0}
+
+def connect(url):
+    """psycopg2 импортируется при первом подключении, а не при загрузке модуля — быстрее холодный старт"""
+    import psycopg2
+    return psycopg2.connect(url)
+
+READ_ACTIONS = {'list'}
+READ_AFTER_WRITE_SEC = float(os.environ.get('READ_AFTER_WRITE_SEC', '5'))
+LAST_WRITE = {}
+
+def get_db(action='', user_id='', req_headers=None):
+    """Read-only действия идут на DATABASE_READ_URL, если пользователь недавно ничего не писал; остальное — на primary"""
+    now = time.time()
+    read_url = os.environ.get('DATABASE_READ_URL', '')
+    if action in READ_ACTIONS:
+        if read_url and not wrote_recently(user_id, req_headers or {}, now):
+            return connect(read_url)
+    elif action and user_id:
+        if len(LAST_WRITE) > 10000:
+            for uid in [u for u, t in LAST_WRITE.items() if now - t >= READ_AFTER_WRITE_SEC]:
+                del LAST_WRITE[uid]
+        LAST_WRITE[user_id] = now
+    return connect(os.environ['DATABASE_URL'])
+
+def wrote_recently(user_id, req_headers, now):
+    """X-Last-Write — сколько мс назад клиент сделал запись (возраст, а не время: не зависит от часов клиента)"""
+    if user_id and now - LAST_WRITE.get(user_id, 0) < READ_AFTER_WRITE_SEC:
+        return True
+    try:
+        return float(req_headers.get('x-last-write', '')) / 1000 < READ_AFTER_WRITE_SEC
+    except ValueError:
+        return False
+
+def b64url_decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
 
-def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+def verify_session(token):
+    """Токен kid.payload.signature (HMAC-SHA256) проверяется в процессе, без запроса к БД; возвращает claims или None"""
+    try:
+        kid, payload, signature = token.split('.')
+        key = SESSION_KEYS.get(kid)
+        if not key:
+            return None
+        expected = hmac.new(key, f'{kid}.{payload}'.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, b64url_decode(signature)):
+            return None
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(claims, dict) or not claims.get('uid') or claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+def authenticate(req_headers, fallback_user_id, action):
+    """user_id из X-Auth-Token; без токена в AUTH_MODE=legacy — как раньше из x-user-id/body/query. None — отказать с 401"""
+    token = req_headers.get('x-auth-token', '')
+    if token:
+        claims = verify_session(token)
+        return (claims['uid'], claims) if claims else (None, None)
+    if AUTH_MODE == 'token' and action:
+        return None, None
+    return fallback_user_id, None
+
+def is_revoked(conn, claims):
+    """Список отозванных сессий кешируется в процессе на REVOCATION_CACHE_SEC; без conn используется кеш как есть"""
+    now = time.time()
+    if conn is not None and now - REVOKED['loaded_at'] > REVOCATION_CACHE_SEC:
+        cur = conn.cursor()
+        cur.execute(f"SELECT jti FROM {RS} WHERE expires_at > now()")
+        REVOKED['jtis'] = {r[0] for r in cur.fetchall()}
+        REVOKED['loaded_at'] = now
+    return claims.get('jti') in REVOKED['jtis']
+
+def unauthorized(headers):
+    return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Требуется авторизация'})}
 
 def parse_body(event):
     raw = event.get('body') or ''
@@ -29,36 +121,37 @@ def parse_body(event):
         except Exception:
             return {}
 
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Last-Write', 'Access-Control-Max-Age': '86400'}
+HEADERS = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+
 def handler(event, context):
     """Статусы пользователей Того — публикация и просмотр (живут 24 часа)"""
     if event.get('httpMethod') == 'OPTIONS':
-        return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id', 'Access-Control-Max-Age': '86400'}, 'body': ''}
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
-    headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+    headers = HEADERS
     method = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters', {}) or {}
     body = parse_body(event)
     action = params.get('action', '') or body.get('action', '')
     req_headers = event.get('headers', {}) or {}
-    user_id = req_headers.get('x-user-id', '') or body.get('user_id', '') or params.get('user_id', '')
+    user_id, claims = authenticate(req_headers, req_headers.get('x-user-id', '') or body.get('user_id', '') or params.get('user_id', ''), action)
+    if user_id is None:
+        return unauthorized(headers)
 
-    conn = get_db()
+    conn = get_db(action, user_id, req_headers)
     cur = conn.cursor()
 
+    if claims and is_revoked(conn, claims):
+        conn.close()
+        return unauthorized(headers)
+
     if action == 'list':
         if not user_id:
             conn.close()
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id required'})}
 
-        cur.execute(f"""
-            SELECT s.id, s.user_id, s.type, s.content, s.image_url, s.created_at,
-                   u.display_name, u.avatar
-            FROM {ST} s
-            JOIN {U} u ON u.id = s.user_id
-            WHERE s.expires_at > now()
-            ORDER BY s.created_at DESC
-            LIMIT 200
-        """)
+        cur.execute(STATUSES_LIST_SQL)
 
         rows = cur.fetchall()
         conn.close()
@@ -97,6 +190,8 @@ def handler(event, context):
 
         if image_data:
             try:
+                import boto3
+                import uuid
                 s3 = boto3.client('s3',
                     endpoint_url='https://bucket.poehali.dev',
                     aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
@@ -1,15 +1,170 @@
 import json
+import base64
+import hmac
+import hashlib
 import os
-import psycopg2
+import time
+import uuid
 
 S = os.environ.get('MAIN_DB_SCHEMA', 'public')
 CALLS = f'"{S}".calls'
 ICE = f'"{S}".ice_candidates'
 U = f'"{S}".users'
 CM = f'"{S}".chat_members'
+ICE_EPHEMERAL = f'"{S}".ice_candidates_ephemeral'
+RS = f'"{S}".revoked_sessions'
+
+CALL_POLL_SQL = f"""
+    SELECT c.id, c.caller_id, c.callee_id, c.chat_id, c.call_type, c.status, c.sdp_offer, c.sdp_answer, c.created_at,
+           u.display_name, u.avatar
+    FROM {CALLS} c
+    JOIN {U} u ON u.id = CASE WHEN c.caller_id = %s::uuid THEN c.callee_id ELSE c.caller_id END
+    WHERE (c.caller_id = %s::uuid OR c.callee_id = %s::uuid)
+      AND c.status IN ('ringing', 'active')
+      AND c.created_at > now() - interval '2 minutes'
+    ORDER BY c.created_at DESC LIMIT 1
+"""
+ICE_TTL_SEC = int(os.environ.get('ICE_TTL_SEC', '120'))
+CALL_POLL_MIN_MS = int(os.environ.get('CALL_POLL_MIN_MS', '1000'))
+CALL_POLL_MAX_MS = int(os.environ.get('CALL_POLL_MAX_MS', '5000'))
+
+SESSION_KEYS = {
+    kid: secret.encode()
+    for kid, _, secret in (item.strip().partition(':') for item in os.environ.get('SESSION_KEYS', '').split(','))
+    if kid and secret
+}
+AUTH_MODE = os.environ.get('AUTH_MODE', 'legacy')
+REVOCATION_CACHE_SEC = int(os.environ.get('REVOCATION_CACHE_SEC', '30'))
+REVOKED = {'jtis': set(), 'loaded_at': 0.0}
+
+def connect(url):
+    """psycopg2 импортируется при первом подключении, а не при загрузке модуля — быстрее холодный старт"""
+    import psycopg2
+    return psycopg2.connect(url)
 
 def get_db():
-    return psycopg2.connect(os.environ['DATABASE_URL'])
+    """Всё идёт на primary: SDP-ответ и ICE-кандидаты пишет другая сторона звонка, и poll должен видеть их сразу,
+    а UNLOGGED ice_candidates_ephemeral на реплике не читается вовсе"""
+    return connect(os.environ['DATABASE_URL'])
+
+class TableIceStore:
+    """ICE-кандидаты в таблице Postgres: ice_candidates (WAL) или ice_candidates_ephemeral (UNLOGGED)"""
+    uses_db = True
+
+    def __init__(self, table, ttl_sec=None):
+        self.table = table
+        self.ttl_sec = ttl_sec
+
+    def add(self, conn, call_id, sender_id, candidate):
+        cur = conn.cursor()
+        cur.execute(
+            f"INSERT INTO {self.table} (call_id, sender_id, candidate) VALUES (%s::uuid, %s::uuid, %s)",
+            (call_id, sender_id, candidate)
+        )
+        conn.commit()
+
+    def fetch(self, conn, call_id, exclude_sender_id):
+        cur = conn.cursor()
+        if self.ttl_sec:
+            cur.execute(
+                f"SELECT id, candidate FROM {self.table} WHERE call_id = %s::uuid AND sender_id != %s::uuid AND created_at > now() - make_interval(secs => %s) ORDER BY created_at ASC",
+                (call_id, exclude_sender_id, self.ttl_sec)
+            )
+        else:
+            cur.execute(f"SELECT id, candidate FROM {self.table} WHERE call_id = %s::uuid AND sender_id != %s::uuid ORDER BY created_at ASC", (call_id, exclude_sender_id))
+        return [{'id': str(r[0]), 'candidate': r[1]} for r in cur.fetchall()]
+
+class MemoryIceStore:
+    """ICE-кандидаты в памяти процесса с TTL — для одного инстанса и тестов"""
+    uses_db = False
+
+    def __init__(self, ttl_sec):
+        self.ttl_sec = ttl_sec
+        self.calls = {}
+        self.pruned_at = 0.0
+
+    def _prune(self, now):
+        if now - self.pruned_at < 1:
+            return
+        self.pruned_at = now
+        for call_id in list(self.calls):
+            fresh = [c for c in self.calls[call_id] if now - c[3] < self.ttl_sec]
+            if fresh:
+                self.calls[call_id] = fresh
+            else:
+                del self.calls[call_id]
+
+    def add(self, conn, call_id, sender_id, candidate):
+        now = time.monotonic()
+        self._prune(now)
+        self.calls.setdefault(call_id, []).append((str(uuid.uuid4()), sender_id, candidate, now))
+
+    def fetch(self, conn, call_id, exclude_sender_id):
+        now = time.monotonic()
+        self._prune(now)
+        return [{'id': c[0], 'candidate': c[2]} for c in self.calls.get(call_id, []) if c[1] != exclude_sender_id and now - c[3] < self.ttl_sec]
+
+def make_ice_store(kind):
+    if kind == 'memory':
+        return MemoryIceStore(ICE_TTL_SEC)
+    if kind == 'unlogged':
+        return TableIceStore(ICE_EPHEMERAL, ICE_TTL_SEC)
+    return TableIceStore(ICE)
+
+ICE_STORE = make_ice_store(os.environ.get('SIGNALING_STORE', 'table'))
+
+def next_poll_after(interval, has_call):
+    """Во время звонка — опрашивать часто; без звонка интервал, которым клиент опрашивал, растёт в 1.5 раза до CALL_POLL_MAX_MS"""
+    if has_call:
+        return CALL_POLL_MIN_MS
+    try:
+        interval = int(interval)
+    except (TypeError, ValueError):
+        return CALL_POLL_MIN_MS
+    return int(min(CALL_POLL_MAX_MS, max(CALL_POLL_MIN_MS, interval * 1.5)))
+
+def b64url_decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+def verify_session(token):
+    """Токен kid.payload.signature (HMAC-SHA256) проверяется в процессе, без запроса к БД; возвращает claims или None"""
+    try:
+        kid, payload, signature = token.split('.')
+        key = SESSION_KEYS.get(kid)
+        if not key:
+            return None
+        expected = hmac.new(key, f'{kid}.{payload}'.encode(), hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, b64url_decode(signature)):
+            return None
+        claims = json.loads(b64url_decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(claims, dict) or not claims.get('uid') or claims.get('exp', 0) < time.time():
+        return None
+    return claims
+
+def authenticate(req_headers, fallback_user_id, action):
+    """user_id из X-Auth-Token; без токена в AUTH_MODE=legacy — как раньше из x-user-id/body/query. None — отказать с 401"""
+    token = req_headers.get('x-auth-token', '')
+    if token:
+        claims = verify_session(token)
+        return (claims['uid'], claims) if claims else (None, None)
+    if AUTH_MODE == 'token' and action:
+        return None, None
+    return fallback_user_id, None
+
+def is_revoked(conn, claims):
+    """Список отозванных сессий кешируется в процессе на REVOCATION_CACHE_SEC; без conn используется кеш как есть"""
+    now = time.time()
+    if conn is not None and now - REVOKED['loaded_at'] > REVOCATION_CACHE_SEC:
+        cur = conn.cursor()
+        cur.execute(f"SELECT jti FROM {RS} WHERE expires_at > now()")
+        REVOKED['jtis'] = {r[0] for r in cur.fetchall()}
+        REVOKED['loaded_at'] = now
+    return claims.get('jti') in REVOKED['jtis']
+
+def unauthorized(headers):
+    return {'statusCode': 401, 'headers': headers, 'body': json.dumps({'error': 'Требуется авторизация'})}
 
 def parse_body(event):
     import base64 as b64
@@ -31,22 +186,51 @@ def parse_body(event):
     except Exception:
         return {}
 
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, X-Last-Write', 'Access-Control-Max-Age': '86400'}
+HEADERS = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+
 def handler(event, context):
     """WebRTC сигналинг для голосовых и видеозвонков в мессенджере Того"""
     if event.get('httpMethod') == 'OPTIONS':
-        return {'statusCode': 200, 'headers': {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS', 'Access-Control-Allow-Headers': 'Content-Type, X-User-Id', 'Access-Control-Max-Age': '86400'}, 'body': ''}
+        return {'statusCode': 200, 'headers': CORS_HEADERS, 'body': ''}
 
-    headers = {'Access-Control-Allow-Origin': '*', 'Content-Type': 'application/json'}
+    headers = HEADERS
     method = event.get('httpMethod', 'GET')
     params = event.get('queryStringParameters', {}) or {}
     body = parse_body(event)
     action = params.get('action', '') or body.get('action', '')
     req_headers = event.get('headers', {}) or {}
-    user_id = req_headers.get('x-user-id', '') or body.get('user_id', '') or params.get('user_id', '')
+    user_id, claims = authenticate(req_headers, req_headers.get('x-user-id', '') or body.get('user_id', '') or params.get('user_id', ''), action)
+    if user_id is None:
+        return unauthorized(headers)
+
+    if method == 'POST' and action == 'ice':
+        call_id = body.get('call_id', '')
+        candidate = body.get('candidate', '')
+
+        if not user_id or not call_id or not candidate:
+            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'call_id and candidate required'})}
+        # Memory-хранилищу БД не нужна, но кеш отозванных сессий всё равно перечитывается раз в REVOCATION_CACHE_SEC
+        revocations_stale = claims and time.time() - REVOKED['loaded_at'] > REVOCATION_CACHE_SEC
+        conn = get_db() if ICE_STORE.uses_db or revocations_stale else None
+        if claims and is_revoked(conn, claims):
+            if conn:
+                conn.close()
+            return unauthorized(headers)
+
+        ICE_STORE.add(conn, call_id, user_id, candidate)
+        if conn:
+            conn.close()
+
+        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'ok': True})}
 
     conn = get_db()
     cur = conn.cursor()
 
+    if claims and is_revoked(conn, claims):
+        conn.close()
+        return unauthorized(headers)
+
     if method == 'POST' and action == 'initiate':
         callee_id = body.get('callee_id', '')
         chat_id = body.get('chat_id', '')
@@ -91,23 +275,6 @@ def handler(event, context):
 
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'ok': True})}
 
-    if method == 'POST' and action == 'ice':
-        call_id = body.get('call_id', '')
-        candidate = body.get('candidate', '')
-
-        if not user_id or not call_id or not candidate:
-            conn.close()
-            return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'call_id and candidate required'})}
-
-        cur.execute(
-            f"INSERT INTO {ICE} (call_id, sender_id, candidate) VALUES (%s::uuid, %s::uuid, %s)",
-            (call_id, user_id, candidate)
-        )
-        conn.commit()
-        conn.close()
-
-        return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'ok': True})}
-
     if method == 'POST' and action == 'end':
         call_id = body.get('call_id', '')
 
@@ -139,27 +306,17 @@ def handler(event, context):
             conn.close()
             return {'statusCode': 400, 'headers': headers, 'body': json.dumps({'error': 'user_id required'})}
 
-        cur.execute(f"""
-            SELECT c.id, c.caller_id, c.callee_id, c.chat_id, c.call_type, c.status, c.sdp_offer, c.sdp_answer, c.created_at,
-                   u.display_name, u.avatar
-            FROM {CALLS} c
-            JOIN {U} u ON u.id = CASE WHEN c.caller_id = %s::uuid THEN c.callee_id ELSE c.caller_id END
-            WHERE (c.caller_id = %s::uuid OR c.callee_id = %s::uuid)
-              AND c.status IN ('ringing', 'active')
-              AND c.created_at > now() - interval '2 minutes'
-            ORDER BY c.created_at DESC LIMIT 1
-        """, (user_id, user_id, user_id))
+        cur.execute(CALL_POLL_SQL, (user_id, user_id, user_id))
 
         row = cur.fetchone()
         if not row:
             conn.close()
-            return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'call': None})}
+            return {'statusCode': 200, 'headers': headers, 'body': json.dumps({'call': None, 'next_poll_after': next_poll_after(params.get('interval'), False)})}
 
         call_id = str(row[0])
         caller_id = str(row[1])
 
-        cur.execute(f"SELECT id, candidate FROM {ICE} WHERE call_id = %s::uuid AND sender_id != %s::uuid ORDER BY created_at ASC", (call_id, user_id))
-        candidates = [{'id': str(r[0]), 'candidate': r[1]} for r in cur.fetchall()]
+        candidates = ICE_STORE.fetch(conn, call_id, user_id)
 
         conn.close()
         return {'statusCode': 200, 'headers': headers, 'body': json.dumps({
@@ -177,6 +334,7 @@ def handler(event, context):
                 'peer_avatar': row[10],
             },
             'ice_candidates': candidates,
+            'next_poll_after': next_poll_after(None, True),
         })}
 
     conn.close()
@@ -0,0 +1,96 @@
+"""Сколько планирования экономят подготовленные запросы для chats list и messages poll/list.
+
+Берёт любого участника чата из chat_members (или BENCH_USER_ID) и сравнивает
+Planning Time из EXPLAIN ANALYZE для обычного запроса и для EXECUTE подготовленного,
+а затем время запроса через handler с PREPARED_STATEMENTS=0 и =1.
+
+    DATABASE_URL=postgres://... MAIN_DB_SCHEMA=... python benchmarks/bench_prepared.py
+"""
+import importlib.util
+import os
+import re
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_function(name, prepared):
+    os.environ['PREPARED_STATEMENTS'] = '1' if prepared else '0'
+    spec = importlib.util.spec_from_file_location(f'{name}_index_{int(prepared)}', os.path.join(ROOT, 'backend', name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def planning_ms(cur, statement, args=None):
+    cur.execute(f'EXPLAIN (ANALYZE, SUMMARY ON) {statement}', args)
+    plan = '\n'.join(r[0] for r in cur.fetchall())
+    return float(re.search(r'Planning Time: ([\d.]+) ms', plan).group(1))
+
+
+def compare_planning(fn, name, sql, args, rounds):
+    conn = fn.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    plain = [planning_ms(cur, sql, args) for _ in range(rounds)]
+    cur.execute(f'PREPARE bench_{name} AS {fn.to_positional(sql)}')
+    placeholders = ', '.join(['%s'] * len(args))
+    prepared = [planning_ms(cur, f'EXECUTE bench_{name} ({placeholders})', args) for _ in range(rounds)]
+    cur.execute(f'DEALLOCATE bench_{name}')
+    conn.rollback()
+    conn.close()
+    print(f'{name:<16} planning plain={statistics.median(plain):.3f}ms '
+          f'prepared={statistics.median(prepared):.3f}ms saved={statistics.median(plain) - statistics.median(prepared):.3f}ms/request')
+
+
+def time_handler(fn, params, user_id, rounds):
+    event = {'httpMethod': 'GET', 'queryStringParameters': params, 'headers': {'x-user-id': user_id}}
+    fn.handler(event, None)
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        res = fn.handler(event, None)
+        timings.append((time.perf_counter() - started) * 1000)
+        assert res['statusCode'] == 200, res
+    return statistics.median(timings)
+
+
+def main():
+    if not os.environ.get('DATABASE_URL'):
+        sys.exit('DATABASE_URL must be set')
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'off')
+    rounds = int(os.environ.get('BENCH_ROUNDS', '50'))
+
+    chats = load_function('chats', True)
+    messages = load_function('messages', True)
+    conn = chats.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    user_id = os.environ.get('BENCH_USER_ID')
+    if user_id:
+        cur.execute(f'SELECT chat_id FROM {chats.CM} WHERE user_id = %s::uuid LIMIT 1', (user_id,))
+        chat_id = str(cur.fetchone()[0])
+    else:
+        cur.execute(f'SELECT user_id, chat_id FROM {chats.CM} WHERE left_at IS NULL LIMIT 1')
+        user_id, chat_id = map(str, cur.fetchone())
+    conn.rollback()
+    after = (datetime.utcnow() - timedelta(minutes=5)).isoformat()
+
+    compare_planning(chats, 'chats_list', chats.CHATS_LIST_SQL, (user_id, user_id, user_id), rounds)
+    compare_planning(messages, 'messages_poll', messages.POLL_SQL, (user_id, after, user_id), rounds)
+    compare_planning(messages, 'messages_latest', messages.MESSAGES_LATEST_SQL, (chat_id, user_id, user_id, 50), rounds)
+
+    cases = [
+        ('chats', {'action': 'list'}),
+        ('messages', {'action': 'poll', 'after': after}),
+        ('messages', {'action': 'list', 'chat_id': chat_id}),
+    ]
+    for name, params in cases:
+        off = time_handler(load_function(name, False), params, user_id, rounds)
+        on = time_handler(load_function(name, True), params, user_id, rounds)
+        print(f'{name} {params["action"]:<6} handler PREPARED_STATEMENTS=0 {off:.2f}ms  =1 {on:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
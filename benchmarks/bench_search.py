@@ -0,0 +1,147 @@
+"""Бенчмарк полнотекстового поиска messages action=search.
+
+Засевает корпус (по умолчанию 10M сообщений в 1000 чатах, пользователь состоит в 100 из них),
+затем гоняет поисковые запросы через handler и печатает перцентили задержки и план запроса.
+
+    DATABASE_URL=postgres://... MAIN_DB_SCHEMA=... python benchmarks/bench_search.py
+    BENCH_MESSAGES=1000000 ...    # корпус поменьше
+    python benchmarks/bench_search.py --drop    # удалить засеянные данные
+"""
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_USER = 'bench_search'
+BENCH_PARTNER = 'bench_search_partner'
+BATCH = 200000
+
+WORDS_RU = ['привет', 'встреча', 'завтра', 'документы', 'отчёт', 'проект', 'звонок', 'адрес', 'подарок', 'отпуск',
+            'машина', 'билеты', 'концерт', 'договор', 'оплата', 'доставка', 'кофе', 'погода', 'работа', 'семья']
+WORDS_EN = ['meeting', 'tomorrow', 'report', 'invoice', 'deploy', 'release', 'weekend', 'flight', 'dinner', 'budget',
+            'contract', 'delivery', 'coffee', 'weather', 'project', 'holiday', 'ticket', 'payment', 'review', 'family']
+QUERIES = ['встреча завтра', 'отчёт', 'договор оплата', 'документы', 'meeting tomorrow', 'invoice', 'deploy release',
+           '"billing report"', 'coffee -weather', 'концерт билеты']
+
+
+def load_function(name):
+    spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(ROOT, 'backend', name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_users(cur, fn):
+    cur.execute(f"SELECT id, username FROM {fn.U} WHERE username IN (%s, %s)", (BENCH_USER, BENCH_PARTNER))
+    return {r[1]: str(r[0]) for r in cur.fetchall()}
+
+
+def seed(conn, fn, total, chats, member_chats):
+    cur = conn.cursor()
+    users = bench_users(cur, fn)
+    if len(users) == 2:
+        print('corpus already seeded, reusing it (run with --drop to reseed)', file=sys.stderr)
+        return users[BENCH_USER]
+
+    for name in (BENCH_USER, BENCH_PARTNER):
+        cur.execute(f"INSERT INTO {fn.U} (username, display_name, password_hash) VALUES (%s, %s, '') RETURNING id", (name, name))
+        users[name] = str(cur.fetchone()[0])
+    cur.execute(f'INSERT INTO "{fn.S}".chats (is_group) SELECT false FROM generate_series(1, %s) RETURNING id', (chats,))
+    chat_ids = [str(r[0]) for r in cur.fetchall()]
+    for i, chat_id in enumerate(chat_ids):
+        cur.execute(f"INSERT INTO {fn.CM} (chat_id, user_id) VALUES (%s::uuid, %s::uuid)", (chat_id, users[BENCH_PARTNER]))
+        if i % (chats // member_chats) == 0:
+            cur.execute(f"INSERT INTO {fn.CM} (chat_id, user_id) VALUES (%s::uuid, %s::uuid)", (chat_id, users[BENCH_USER]))
+    conn.commit()
+
+    words = WORDS_RU + WORDS_EN
+    started = time.perf_counter()
+    for first in range(1, total + 1, BATCH):
+        last = min(total, first + BATCH - 1)
+        cur.execute(f"""
+            INSERT INTO {fn.M} (chat_id, sender_id, text, status, created_at)
+            SELECT (%s::uuid[])[1 + g %% %s],
+                   CASE WHEN g %% 2 = 0 THEN %s::uuid ELSE %s::uuid END,
+                   (SELECT string_agg((%s::text[])[1 + floor(random() * %s)::int], ' ') FROM generate_series(1, 4 + g %% 12)),
+                   'delivered',
+                   now() - make_interval(secs => g)
+            FROM generate_series(%s, %s) g
+        """, (chat_ids, chats, users[BENCH_USER], users[BENCH_PARTNER], words, len(words), first, last))
+        conn.commit()
+        print(f'seeded {last}/{total} messages ({time.perf_counter() - started:.0f}s)', file=sys.stderr)
+    cur.execute(f'ANALYZE {fn.M}')
+    conn.commit()
+    return users[BENCH_USER]
+
+
+def drop(conn, fn):
+    cur = conn.cursor()
+    users = list(bench_users(cur, fn).values())
+    if not users:
+        return
+    cur.execute(f"SELECT DISTINCT chat_id FROM {fn.CM} WHERE user_id = ANY(%s::uuid[])", (users,))
+    chat_ids = [str(r[0]) for r in cur.fetchall()]
+    cur.execute(f"DELETE FROM {fn.M} WHERE chat_id = ANY(%s::uuid[])", (chat_ids,))
+    cur.execute(f"DELETE FROM {fn.CM} WHERE chat_id = ANY(%s::uuid[])", (chat_ids,))
+    cur.execute(f'DELETE FROM "{fn.S}".chats WHERE id = ANY(%s::uuid[])', (chat_ids,))
+    cur.execute(f"DELETE FROM {fn.U} WHERE id = ANY(%s::uuid[])", (users,))
+    conn.commit()
+
+
+def search(fn, user_id, query, chat_id=''):
+    params = {'action': 'search', 'q': query, 'limit': '20'}
+    if chat_id:
+        params['chat_id'] = chat_id
+    started = time.perf_counter()
+    res = fn.handler({'httpMethod': 'GET', 'queryStringParameters': params, 'headers': {'x-user-id': user_id}}, None)
+    elapsed = (time.perf_counter() - started) * 1000
+    assert res['statusCode'] == 200, res
+    return elapsed, len(json.loads(res['body'])['messages'])
+
+
+def main():
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'off')
+    fn = load_function('messages')
+    conn = fn.get_db()
+    if '--drop' in sys.argv:
+        drop(conn, fn)
+        conn.close()
+        return
+
+    total = int(os.environ.get('BENCH_MESSAGES', '10000000'))
+    user_id = seed(conn, fn, total, chats=1000, member_chats=100)
+    cur = conn.cursor()
+    cur.execute(f"SELECT chat_id FROM {fn.CM} WHERE user_id = %s::uuid LIMIT 1", (user_id,))
+    one_chat = str(cur.fetchone()[0])
+
+    rounds = int(os.environ.get('BENCH_ROUNDS', '5'))
+    for label, chat_id in (('all chats', ''), ('one chat', one_chat)):
+        timings = []
+        hits = 0
+        for _ in range(rounds):
+            for query in QUERIES:
+                elapsed, found = search(fn, user_id, query, chat_id)
+                timings.append(elapsed)
+                hits += found
+        timings.sort()
+        print(f'{label:<10} n={len(timings)} p50={statistics.median(timings):.1f}ms '
+              f'p95={timings[int(len(timings) * 0.95) - 1]:.1f}ms max={timings[-1]:.1f}ms hits={hits}')
+
+    cur.execute(f"""
+        EXPLAIN (ANALYZE, BUFFERS)
+        SELECT m.id, ts_rank(m.search_tsv, q.query) AS rank
+        FROM (SELECT websearch_to_tsquery('russian', %s) || websearch_to_tsquery('english', %s) AS query) q
+        JOIN {fn.M} m ON m.search_tsv @@ q.query
+        JOIN {fn.CM} cm ON cm.chat_id = m.chat_id AND cm.user_id = %s::uuid AND cm.left_at IS NULL
+        WHERE m.hidden_for_all = false
+        ORDER BY rank DESC, m.created_at DESC LIMIT 21
+    """, (QUERIES[0], QUERIES[0], user_id))
+    print('\n'.join(r[0] for r in cur.fetchall()))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Сколько стоит проверка X-Auth-Token в процессе (verify_session) по сравнению с запросом к users.
+
+    python benchmarks/bench_session.py
+    DATABASE_URL=postgres://... python benchmarks/bench_session.py   # плюс SELECT по users для сравнения
+"""
+import importlib.util
+import os
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_function(name):
+    spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(ROOT, 'backend', name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def per_call_us(fn, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def main():
+    os.environ.setdefault('SESSION_KEYS', 'bench:bench-secret')
+    auth = load_function('auth')
+    messages = load_function('messages')
+    token = auth.issue_session('00000000-0000-0000-0000-000000000001')
+    headers = {'x-auth-token': token}
+
+    print(f'verify_session      {per_call_us(lambda: messages.verify_session(token), 50000):8.1f} us')
+    print(f'authenticate        {per_call_us(lambda: messages.authenticate(headers, "", "poll"), 50000):8.1f} us')
+    messages.REVOKED['loaded_at'] = time.time()
+    claims = messages.verify_session(token)
+    print(f'is_revoked (cached) {per_call_us(lambda: messages.is_revoked(None, claims), 50000):8.1f} us')
+
+    if os.environ.get('DATABASE_URL'):
+        conn = messages.get_db()
+        cur = conn.cursor()
+
+        def lookup():
+            cur.execute(f'SELECT id FROM {messages.U} WHERE id = %s::uuid', (claims['uid'],))
+            cur.fetchone()
+
+        print(f'users lookup        {per_call_us(lookup, 2000):8.1f} us')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
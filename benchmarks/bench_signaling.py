@@ -0,0 +1,99 @@
+"""Бенчмарк хранилищ ICE-кандидатов webrtc: кандидатов в секунду на запись и чтение.
+
+Запуск:
+    python benchmarks/bench_signaling.py                   # только memory
+    DATABASE_URL=postgres://... MAIN_DB_SCHEMA=... python benchmarks/bench_signaling.py
+"""
+import importlib.util
+import os
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_function(name):
+    spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(ROOT, 'backend', name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def create_calls(webrtc, conn, calls):
+    """Создаёт двух пользователей, чат и звонки — ice_candidates ссылается на calls"""
+    cur = conn.cursor()
+    users = []
+    for _ in range(2):
+        name = f'bench_{uuid.uuid4().hex[:12]}'
+        cur.execute(f"INSERT INTO {webrtc.U} (username, display_name, password_hash) VALUES (%s, %s, '') RETURNING id", (name, name))
+        users.append(str(cur.fetchone()[0]))
+    cur.execute(f'INSERT INTO "{webrtc.S}".chats (is_group) VALUES (false) RETURNING id')
+    chat_id = str(cur.fetchone()[0])
+    call_ids = []
+    for _ in range(calls):
+        cur.execute(f"INSERT INTO {webrtc.CALLS} (caller_id, callee_id, chat_id, status) VALUES (%s::uuid, %s::uuid, %s::uuid, 'ended') RETURNING id", (users[0], users[1], chat_id))
+        call_ids.append(str(cur.fetchone()[0]))
+    conn.commit()
+    return users, chat_id, call_ids
+
+
+def drop_calls(webrtc, conn, users, chat_id, call_ids):
+    cur = conn.cursor()
+    for table in (webrtc.ICE, webrtc.ICE_EPHEMERAL):
+        cur.execute(f"DELETE FROM {table} WHERE call_id = ANY(%s::uuid[])", (call_ids,))
+    cur.execute(f"DELETE FROM {webrtc.CALLS} WHERE id = ANY(%s::uuid[])", (call_ids,))
+    cur.execute(f'DELETE FROM "{webrtc.S}".chats WHERE id = %s::uuid', (chat_id,))
+    cur.execute(f"DELETE FROM {webrtc.U} WHERE id = ANY(%s::uuid[])", (users,))
+    conn.commit()
+
+
+def bench(store, conn, call_ids, caller, callee, per_call):
+    calls = len(call_ids)
+    candidate = 'candidate:842163049 1 udp 1677729535 203.0.113.7 46154 typ srflx raddr 0.0.0.0 rport 0 generation 0'
+
+    started = time.perf_counter()
+    for call_id in call_ids:
+        for i in range(per_call):
+            store.add(conn, call_id, caller if i % 2 else callee, candidate)
+    write_sec = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for call_id in call_ids:
+        store.fetch(conn, call_id, caller)
+    read_sec = time.perf_counter() - started
+
+    total = calls * per_call
+    return total / write_sec, calls / read_sec
+
+
+def main():
+    calls = int(os.environ.get('BENCH_CALLS', '50'))
+    per_call = int(os.environ.get('BENCH_CANDIDATES', '40'))
+    webrtc = load_function('webrtc')
+
+    kinds = ['memory']
+    if os.environ.get('DATABASE_URL'):
+        kinds += ['table', 'unlogged']
+    else:
+        print('DATABASE_URL not set — skipping table and unlogged backends', file=sys.stderr)
+
+    print(f'{"backend":<10} {"cand/sec":>12} {"polls/sec":>12}')
+    for kind in kinds:
+        store = webrtc.make_ice_store(kind)
+        if store.uses_db:
+            conn = webrtc.get_db()
+            users, chat_id, call_ids = create_calls(webrtc, conn, calls)
+            try:
+                writes, reads = bench(store, conn, call_ids, users[0], users[1], per_call)
+            finally:
+                drop_calls(webrtc, conn, users, chat_id, call_ids)
+                conn.close()
+        else:
+            call_ids = [str(uuid.uuid4()) for _ in range(calls)]
+            writes, reads = bench(store, None, call_ids, str(uuid.uuid4()), str(uuid.uuid4()), per_call)
+        print(f'{kind:<10} {writes:>12.0f} {reads:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
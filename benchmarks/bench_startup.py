@@ -0,0 +1,58 @@
+"""Время холодного старта каждой функции: импорт index.py и первый вызов handler (OPTIONS, без БД).
+
+Каждая функция запускается в отдельном процессе; время меряется от начала импорта, без старта интерпретатора.
+Выходит с кодом 1, если какая-то функция превысила бюджет.
+
+    python benchmarks/bench_startup.py
+    STARTUP_BUDGET_MS=80 BENCH_RUNS=10 python benchmarks/bench_startup.py
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = ['auth', 'chats', 'messages', 'statuses', 'webrtc', 'maintenance', 'attachments']
+
+PROBE = '''
+import sys, time
+started = time.perf_counter()
+import index
+imported = time.perf_counter()
+index.handler({'httpMethod': 'OPTIONS'}, None)
+done = time.perf_counter()
+print((imported - started) * 1000, (done - started) * 1000)
+'''
+
+
+def run(cwd, code):
+    out = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True, text=True, check=True)
+    return out.stdout
+
+
+def main():
+    budget_ms = float(os.environ.get('STARTUP_BUDGET_MS', '50'))
+    runs = int(os.environ.get('BENCH_RUNS', '5'))
+    failed = []
+
+    print(f'{"function":<12} {"import ms":>10} {"cold start ms":>14}   budget {budget_ms:.0f} ms')
+    for name in FUNCTIONS:
+        cwd = os.path.join(ROOT, 'backend', name)
+        imports, starts = [], []
+        for _ in range(runs):
+            imported, started = map(float, run(cwd, PROBE).split())
+            imports.append(imported)
+            starts.append(started)
+        cold = statistics.median(starts)
+        over = cold > budget_ms
+        if over:
+            failed.append(name)
+        print(f'{name:<12} {statistics.median(imports):>10.1f} {cold:>14.1f}   {"OVER BUDGET" if over else "ok"}')
+
+    if failed:
+        print(f'startup budget exceeded: {", ".join(failed)}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Сквозная проверка вложений против локального S3 (например, MinIO) и Postgres.
+
+Загружает случайный файл частями по подписанным ссылкам из attachments, прерывает загрузку и продолжает
+её по status, загружает то же содержимое от другого пользователя (init не выдаёт, что файл уже есть; после
+complete лишняя копия удаляется), отправляет и пересылает вложение через messages и проверяет, что list
+отдаёт его метаданные, а в хранилище остаётся один объект.
+
+    docker run -p 9000:9000 minio/minio server /data    # бакет S3_BUCKET должен существовать
+    DATABASE_URL=postgres://... MAIN_DB_SCHEMA=... S3_ENDPOINT_URL=http://localhost:9000 \\
+    ATTACHMENT_PUBLIC_URL=http://localhost:9000/files AWS_ACCESS_KEY_ID=... AWS_SECRET_ACCESS_KEY=... \\
+        python benchmarks/check_attachments.py
+"""
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import time
+import urllib.request
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_function(name):
+    spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(ROOT, 'backend', name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def call(fn, method, user_id, body):
+    event = {'httpMethod': method, 'headers': {'x-user-id': user_id}}
+    if method == 'GET':
+        event['queryStringParameters'] = body
+    else:
+        event['body'] = json.dumps(body)
+    res = fn.handler(event, None)
+    return res['statusCode'], json.loads(res['body'])
+
+
+def put_parts(state, data):
+    """PUT частей прямо в S3 по part_urls — так же, как это делает клиент"""
+    for part, url in state['part_urls'].items():
+        part = int(part)
+        chunk = data[(part - 1) * state['chunk_size']:part * state['chunk_size']]
+        urllib.request.urlopen(urllib.request.Request(url, data=chunk, method='PUT')).read()
+
+
+def upload(attachments, user_id, data, name):
+    sha256 = hashlib.sha256(data).hexdigest()
+    status, state = call(attachments, 'POST', user_id, {'action': 'init', 'sha256': sha256, 'size': len(data), 'name': name})
+    put_parts(state, data)
+    return call(attachments, 'POST', user_id, {'action': 'complete', 'attachment_id': state['attachment_id']})
+
+
+def check(label, ok):
+    print(f'{"ok  " if ok else "FAIL"} {label}')
+    return 0 if ok else 1
+
+
+def main():
+    for var in ('DATABASE_URL', 'S3_ENDPOINT_URL', 'AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        if not os.environ.get(var):
+            sys.exit(f'{var} must be set')
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'off')
+    attachments = load_function('attachments')
+    messages = load_function('messages')
+
+    conn = messages.connect(os.environ['DATABASE_URL'])
+    cur = conn.cursor()
+    users = []
+    for _ in range(3):
+        name = f'bench_{uuid.uuid4().hex[:12]}'
+        cur.execute(f"INSERT INTO {messages.U} (username, display_name, password_hash) VALUES (%s, %s, '') RETURNING id", (name, name))
+        users.append(str(cur.fetchone()[0]))
+    cur.execute(f'INSERT INTO "{messages.S}".chats (is_group) VALUES (false) RETURNING id')
+    chat_id = str(cur.fetchone()[0])
+    for user_id in users[:2]:
+        cur.execute(f"INSERT INTO {messages.CM} (chat_id, user_id) VALUES (%s::uuid, %s::uuid)", (chat_id, user_id))
+    conn.commit()
+
+    size = int(os.environ.get('BENCH_FILE_BYTES', str(12 * 1024 * 1024)))
+    data = os.urandom(size)
+    sha256 = hashlib.sha256(data).hexdigest()
+    failures = 0
+    try:
+        status, state = call(attachments, 'POST', users[0], {'action': 'init', 'sha256': sha256, 'size': size, 'name': 'random.bin'})
+        failures += check('init starts an upload with presigned part URLs', status == 200 and state['status'] == 'uploading'
+                          and len(state['part_urls']) == state['parts'])
+        attachment_id, parts = state['attachment_id'], state['parts']
+
+        started = time.perf_counter()
+        put_parts({**state, 'part_urls': {'1': state['part_urls']['1']}}, data)
+        status, state = call(attachments, 'GET', users[0], {'action': 'status', 'attachment_id': attachment_id})
+        failures += check('status lists the uploaded part after an interruption', state['uploaded'] == [1] and '1' not in state['part_urls'])
+        put_parts(state, data)
+        status, state = call(attachments, 'POST', users[0], {'action': 'complete', 'attachment_id': attachment_id})
+        elapsed = time.perf_counter() - started
+        failures += check('complete verifies sha256 and marks the file ready', status == 200 and state['status'] == 'ready')
+        print(f'     upload {size / 1024 / 1024:.1f} MiB in {parts} parts: {size / 1024 / 1024 / elapsed:.1f} MiB/s')
+
+        cur.execute(f"SELECT upload_key FROM {attachments.A} WHERE id = %s::uuid", (attachment_id,))
+        first_key = cur.fetchone()[0]
+        status, dup = call(attachments, 'POST', users[1], {'action': 'init', 'sha256': sha256, 'size': size, 'name': 'copy.bin'})
+        failures += check('init of known content does not reveal that it is stored', dup['status'] == 'uploading' and not dup['url'])
+        put_parts(dup, os.urandom(size))
+        status, _ = call(attachments, 'POST', users[1], {'action': 'complete', 'attachment_id': dup['attachment_id']})
+        failures += check('knowing the sha256 without the content is not enough', status == 422)
+        status, dup = upload(attachments, users[1], data, 'copy.bin')
+        failures += check('uploading the same content again links to the stored copy', dup['status'] == 'ready' and dup['url'] == state['url'])
+
+        status, sent = call(messages, 'POST', users[0], {'action': 'send', 'chat_id': chat_id, 'attachment_ids': [attachment_id]})
+        failures += check('send with an attachment and no text', status == 200 and sent['attachments'][0]['sha256'] == sha256)
+        status, _ = call(messages, 'POST', users[1], {'action': 'send', 'chat_id': chat_id, 'text': 'fwd', 'attachment_ids': [attachment_id]})
+        failures += check('chat member can forward an attachment they did not upload', status == 200)
+        status, _ = call(messages, 'POST', users[2], {'action': 'send', 'chat_id': chat_id, 'attachment_ids': [attachment_id]})
+        failures += check('non-member cannot attach it', status == 400)
+
+        status, listed = call(messages, 'GET', users[1], {'action': 'list', 'chat_id': chat_id})
+        failures += check('list returns attachment metadata inline', all(m['attachments'] for m in listed['messages']))
+
+        s3 = attachments.s3_client()
+        cur.execute(f"SELECT upload_key FROM {attachments.A} WHERE id = %s::uuid", (dup['attachment_id'],))
+        second_key = cur.fetchone()[0]
+        kept = s3.list_objects_v2(Bucket=attachments.S3_BUCKET, Prefix=first_key).get('KeyCount')
+        dropped = s3.list_objects_v2(Bucket=attachments.S3_BUCKET, Prefix=second_key).get('KeyCount')
+        failures += check('storage holds a single object for the content', kept == 1 and dropped == 0)
+    finally:
+        cur.execute(f'DELETE FROM {messages.MA} WHERE message_id IN (SELECT id FROM {messages.M} WHERE chat_id = %s::uuid)', (chat_id,))
+        cur.execute(f"DELETE FROM {messages.M} WHERE chat_id = %s::uuid", (chat_id,))
+        cur.execute(f"SELECT a.upload_key, a.upload_id, b.storage_key FROM {attachments.A} a LEFT JOIN {attachments.AB} b ON b.sha256 = a.sha256 WHERE a.owner_id = ANY(%s::uuid[])", (users,))
+        for upload_key, upload_id, stored_key in cur.fetchall():
+            if upload_id:
+                attachments.s3_client().abort_multipart_upload(Bucket=attachments.S3_BUCKET, Key=upload_key, UploadId=upload_id)
+            if stored_key:
+                attachments.s3_client().delete_object(Bucket=attachments.S3_BUCKET, Key=stored_key)
+        cur.execute(f"SELECT DISTINCT sha256 FROM {attachments.A} WHERE owner_id = ANY(%s::uuid[]) AND sha256 IS NOT NULL", (users,))
+        shas = [r[0] for r in cur.fetchall()]
+        cur.execute(f"DELETE FROM {attachments.A} WHERE owner_id = ANY(%s::uuid[])", (users,))
+        cur.execute(f"DELETE FROM {attachments.AB} WHERE sha256 = ANY(%s)", (shas,))
+        cur.execute(f"DELETE FROM {messages.CM} WHERE chat_id = %s::uuid", (chat_id,))
+        cur.execute(f'DELETE FROM "{messages.S}".chats WHERE id = %s::uuid', (chat_id,))
+        cur.execute(f"DELETE FROM {messages.U} WHERE id = ANY(%s::uuid[])", (users,))
+        conn.commit()
+        conn.close()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Проверка маршрутизации чтений на реплику на двух локальных Postgres.
+
+Реплика не обязана реплицировать: скрипт смотрит только, к какому серверу
+(по inet_server_port) подключается get_db каждой функции.
+
+    DATABASE_URL=postgres://localhost:5432/db DATABASE_READ_URL=postgres://localhost:5433/db \\
+        python benchmarks/check_read_routing.py
+"""
+import importlib.util
+import os
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    'chats': ('list', 'create'),
+    'messages': ('poll', 'send'),
+    'statuses': ('list', 'publish'),
+    'auth': ('search', 'update_profile'),
+}
+
+# Функции без реплики: handler должен подключаться только к DATABASE_URL
+PRIMARY_ONLY = {
+    'webrtc': 'poll',
+}
+
+
+def load_function(name):
+    spec = importlib.util.spec_from_file_location(f'{name}_index', os.path.join(ROOT, 'backend', name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def server_port(conn):
+    cur = conn.cursor()
+    cur.execute('SELECT inet_server_port()')
+    port = cur.fetchone()[0]
+    conn.close()
+    return port
+
+
+def main():
+    if not os.environ.get('DATABASE_URL') or not os.environ.get('DATABASE_READ_URL'):
+        sys.exit('DATABASE_URL and DATABASE_READ_URL must both be set')
+
+    failures = 0
+    for name, (read_action, write_action) in CASES.items():
+        fn = load_function(name)
+        primary = server_port(fn.get_db())
+        user_id = str(uuid.uuid4())
+        checks = [
+            ('read', server_port(fn.get_db(read_action, user_id, {})), 'replica'),
+            ('write', server_port(fn.get_db(write_action, user_id, {})), 'primary'),
+            ('read after own write', server_port(fn.get_db(read_action, user_id, {})), 'primary'),
+            ('read, other user', server_port(fn.get_db(read_action, str(uuid.uuid4()), {})), 'replica'),
+            ('read, X-Last-Write=100', server_port(fn.get_db(read_action, str(uuid.uuid4()), {'x-last-write': '100'})), 'primary'),
+        ]
+        fn.LAST_WRITE.clear()
+        fn.LAST_WRITE[user_id] = time.time() - fn.READ_AFTER_WRITE_SEC - 1
+        checks.append(('read after window', server_port(fn.get_db(read_action, user_id, {})), 'replica'))
+
+        for label, port, expected in checks:
+            ok = (port == primary) == (expected == 'primary')
+            failures += not ok
+            print(f'{"ok  " if ok else "FAIL"} {name:<9} {label:<24} -> {expected}')
+
+    for name, read_action in PRIMARY_ONLY.items():
+        fn = load_function(name)
+        urls = []
+        connect = fn.connect
+        fn.connect = lambda url: urls.append(url) or connect(url)
+        fn.handler({'httpMethod': 'GET', 'queryStringParameters': {'action': read_action}, 'headers': {'x-user-id': str(uuid.uuid4())}}, None)
+        ok = urls == [os.environ['DATABASE_URL']]
+        failures += not ok
+        print(f'{"ok  " if ok else "FAIL"} {name:<9} {read_action + " handler":<24} -> primary')
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
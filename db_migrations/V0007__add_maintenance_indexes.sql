@@ -0,0 +1,3 @@
+CREATE INDEX idx_calls_open_created_at ON "t_p37596662_server_chat_connecti".calls(created_at) WHERE status IN ('ringing', 'active');
+CREATE INDEX idx_ice_created_at ON "t_p37596662_server_chat_connecti".ice_candidates(created_at);
+CREATE INDEX idx_messages_hidden_purge ON "t_p37596662_server_chat_connecti".messages(hidden_at) WHERE hidden_for_all = true AND text <> '';
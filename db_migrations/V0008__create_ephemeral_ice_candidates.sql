@@ -0,0 +1,10 @@
+CREATE UNLOGGED TABLE "t_p37596662_server_chat_connecti".ice_candidates_ephemeral (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    call_id UUID NOT NULL,
+    sender_id UUID NOT NULL,
+    candidate TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX idx_ice_ephemeral_call_id ON "t_p37596662_server_chat_connecti".ice_candidates_ephemeral(call_id, sender_id);
+CREATE INDEX idx_ice_ephemeral_created_at ON "t_p37596662_server_chat_connecti".ice_candidates_ephemeral(created_at);
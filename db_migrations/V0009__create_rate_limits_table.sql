@@ -0,0 +1,9 @@
+CREATE UNLOGGED TABLE "t_p37596662_server_chat_connecti".rate_limits (
+    user_id TEXT NOT NULL,
+    action VARCHAR(32) NOT NULL,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, action)
+);
+
+CREATE INDEX idx_rate_limits_updated_at ON "t_p37596662_server_chat_connecti".rate_limits(updated_at);
@@ -0,0 +1,6 @@
+ALTER TABLE "t_p37596662_server_chat_connecti".messages
+    ADD COLUMN search_tsv tsvector GENERATED ALWAYS AS (
+        to_tsvector('russian', coalesce(text, '')) || to_tsvector('english', coalesce(text, ''))
+    ) STORED;
+
+CREATE INDEX idx_messages_search_tsv ON "t_p37596662_server_chat_connecti".messages USING GIN (search_tsv);
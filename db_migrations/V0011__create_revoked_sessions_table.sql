@@ -0,0 +1,8 @@
+CREATE TABLE "t_p37596662_server_chat_connecti".revoked_sessions (
+    jti VARCHAR(64) PRIMARY KEY,
+    user_id UUID NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    revoked_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE INDEX idx_revoked_sessions_expires_at ON "t_p37596662_server_chat_connecti".revoked_sessions(expires_at);
@@ -0,0 +1,15 @@
+ALTER TABLE "t_p37596662_server_chat_connecti".chat_members ADD COLUMN delivered_up_to timestamp without time zone;
+ALTER TABLE "t_p37596662_server_chat_connecti".chat_members ADD COLUMN read_up_to timestamp without time zone;
+
+UPDATE "t_p37596662_server_chat_connecti".chat_members cm
+SET read_up_to = x.up_to, delivered_up_to = x.up_to
+FROM (
+    SELECT m.chat_id, cm2.user_id, MAX(m.created_at) AS up_to
+    FROM "t_p37596662_server_chat_connecti".messages m
+    JOIN "t_p37596662_server_chat_connecti".chat_members cm2 ON cm2.chat_id = m.chat_id AND cm2.user_id != m.sender_id
+    WHERE m.status = 'delivered'
+    GROUP BY m.chat_id, cm2.user_id
+) x
+WHERE cm.chat_id = x.chat_id AND cm.user_id = x.user_id;
+
+CREATE INDEX idx_messages_chat_created_at ON "t_p37596662_server_chat_connecti".messages(chat_id, created_at);
@@ -0,0 +1,33 @@
+CREATE TABLE "t_p37596662_server_chat_connecti".attachment_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    size BIGINT NOT NULL,
+    storage_key TEXT NOT NULL,
+    url TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE TABLE "t_p37596662_server_chat_connecti".attachments (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    owner_id UUID NOT NULL REFERENCES "t_p37596662_server_chat_connecti".users(id),
+    sha256 CHAR(64) REFERENCES "t_p37596662_server_chat_connecti".attachment_blobs(sha256),
+    expected_sha256 CHAR(64) NOT NULL,
+    size BIGINT NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    upload_key TEXT NOT NULL,
+    upload_id TEXT,
+    completing_at TIMESTAMP,
+    name VARCHAR(255) NOT NULL DEFAULT '',
+    mime VARCHAR(127) NOT NULL DEFAULT 'application/octet-stream',
+    created_at TIMESTAMP NOT NULL DEFAULT now()
+);
+
+CREATE TABLE "t_p37596662_server_chat_connecti".message_attachments (
+    message_id UUID NOT NULL REFERENCES "t_p37596662_server_chat_connecti".messages(id),
+    attachment_id UUID NOT NULL REFERENCES "t_p37596662_server_chat_connecti".attachments(id),
+    position SMALLINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (message_id, attachment_id)
+);
+
+CREATE INDEX idx_attachments_sha256 ON "t_p37596662_server_chat_connecti".attachments(sha256);
+CREATE INDEX idx_attachments_uploading ON "t_p37596662_server_chat_connecti".attachments(created_at) WHERE sha256 IS NULL;
+CREATE INDEX idx_message_attachments_attachment_id ON "t_p37596662_server_chat_connecti".message_attachments(attachment_id);
@@ -56,6 +56,7 @@ export default function AuthScreen({ onAuth }: AuthScreenProps) {
       } else if (result.user_id) {
         localStorage.setItem('cipher_user_id', result.user_id);
         localStorage.setItem('cipher_user', JSON.stringify(result));
+        if (result.token) localStorage.setItem('cipher_token', result.token);
         onAuth(result);
       } else {
         setError('Ошибка соединения. Попробуй ещё раз.');
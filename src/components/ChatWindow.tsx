@@ -30,6 +30,7 @@ function MessageStatus({ status }: { status: Message['status'] }) {
     case 'sending': return <Icon name="Clock" size={12} className="text-primary-foreground/60 animate-pulse-dot" />;
     case 'sent': return <Icon name="Check" size={12} className="text-primary-foreground/60" />;
     case 'delivered': return <Icon name="CheckCheck" size={12} className="text-primary-foreground/80" />;
+    case 'read': return <Icon name="CheckCheck" size={12} className="text-sky-300" />;
     case 'failed': return <Icon name="AlertCircle" size={12} className="text-red-400" />;
   }
 }
@@ -173,7 +174,15 @@ export default function ChatWindow({ chat, messages, online, onSend, onBack, onC
                     : 'bg-muted text-foreground rounded-bl-md'
                 } ${msg.status === 'failed' ? 'opacity-60' : ''}`}
               >
-                <p className="text-sm whitespace-pre-wrap break-words">{msg.text}</p>
+                {msg.attachments?.map(a => (
+                  <a key={a.id} href={a.url} target="_blank" rel="noreferrer" onClick={e => e.stopPropagation()}
+                    className="flex items-center gap-2 mb-1 text-sm underline-offset-2 hover:underline">
+                    <Icon name="Paperclip" size={14} />
+                    <span className="truncate">{a.name || 'Файл'}</span>
+                    <span className="text-[10px] opacity-70 shrink-0">{(a.size / 1024 / 1024).toFixed(1)} МБ</span>
+                  </a>
+                ))}
+                {msg.text && <p className="text-sm whitespace-pre-wrap break-words">{msg.text}</p>}
                 <div className={`flex items-center justify-end gap-1 mt-1 ${
                   msg.sender === 'me' ? 'text-primary-foreground/60' : 'text-muted-foreground'
                 }`}>
@@ -3,7 +3,9 @@ import { type Chat, type Message, saveChat, saveMessage, getMessages as getLocal
 import * as api from '@/lib/api';
 import useNetwork from '@/hooks/use-network';
 import useMessageQueue from '@/hooks/use-message-queue';
-import { type ServerChat, type ServerMessage, toLocalChat, toLocalMessage } from '@/lib/chat-types';
+import { type ServerChat, type ServerMessage, type ServerReceipt, toLocalChat, toLocalMessage, toServerTime, applyReceipt } from '@/lib/chat-types';
+
+const POLL_DEFAULT_MS = 1500;
 
 export type UserData = { user_id: string; phone?: string; display_name: string; avatar: string };
 
@@ -35,8 +37,11 @@ export function useChatData() {
   const [initialized, setInitialized] = useState(false);
   const [newChatOpen, setNewChatOpen] = useState(false);
   const lastPollRef = useRef<string>(new Date().toISOString());
+  const messagesRef = useRef<Message[]>([]);
   const notifPermRef = useRef<NotificationPermission>('default');
 
+  useEffect(() => { messagesRef.current = messages; }, [messages]);
+
   const network = useNetwork();
   const { enqueue, syncing, queueLength } = useMessageQueue(network.online);
 
@@ -140,13 +145,28 @@ export function useChatData() {
 
   useEffect(() => {
     if (!user || !network.online) return;
-    const interval = setInterval(async () => {
+    let timer: ReturnType<typeof setTimeout>;
+    let stopped = false;
+    const poll = async () => {
+      let delay = POLL_DEFAULT_MS;
       try {
-        const result = await api.pollMessages(lastPollRef.current);
+        const pending = messagesRef.current.filter(m => m.sender === 'me' && (m.status === 'sent' || m.status === 'delivered'));
+        const receiptsSince = pending.length ? toServerTime(Math.min(...pending.map(m => m.timestamp))) : undefined;
+        const result = await api.pollMessages(lastPollRef.current, receiptsSince);
+        if (result.next_poll_after) delay = result.next_poll_after;
+        if (result.receipts && result.receipts.length > 0) {
+          const receipt = result.receipts.find((r: ServerReceipt) => r.chat_id === activeChatId);
+          if (receipt) {
+            const updated = messagesRef.current.map(m => applyReceipt(m, receipt)).filter((m, i) => m !== messagesRef.current[i]);
+            for (const m of updated) await saveMessage(m);
+            if (updated.length > 0) setMessages(prev => prev.map(m => applyReceipt(m, receipt)));
+          }
+        }
         if (result.messages && result.messages.length > 0) {
           const newMsgs = result.messages.map((m: ServerMessage) => toLocalMessage(m, user.user_id));
           for (const m of newMsgs) await saveMessage(m);
           lastPollRef.current = result.messages[result.messages.length - 1].created_at;
+          api.ackMessages(lastPollRef.current);
           if (activeChatId) {
             const chatMsgs = newMsgs.filter((m: Message) => m.chatId === activeChatId);
             if (chatMsgs.length > 0) setMessages(prev => [...prev, ...chatMsgs]);
@@ -178,8 +198,10 @@ export function useChatData() {
           }
         }
       } catch { /* noop */ }
-    }, 1500);
-    return () => clearInterval(interval);
+      if (!stopped) timer = setTimeout(poll, delay);
+    };
+    timer = setTimeout(poll, POLL_DEFAULT_MS);
+    return () => { stopped = true; clearTimeout(timer); };
   }, [user, network.online, activeChatId, loadChats, chats, playNotifSound]);
 
   const handleSelectChat = useCallback((id: string) => {
@@ -199,9 +221,9 @@ export function useChatData() {
       try {
         const result = await api.sendMessage(activeChatId, text, clientId);
         if (result.id) {
-          const delivered: Message = { ...msg, id: result.id, status: 'delivered' };
-          await saveMessage(delivered);
-          setMessages(prev => prev.map(m => m.id === clientId ? delivered : m));
+          const sent: Message = { ...msg, id: result.id, status: 'sent', timestamp: result.created_at ? new Date(result.created_at).getTime() : msg.timestamp };
+          await saveMessage(sent);
+          setMessages(prev => prev.map(m => m.id === clientId ? sent : m));
           lastPollRef.current = result.created_at || new Date().toISOString();
         }
       } catch {
@@ -236,7 +258,16 @@ export function useChatData() {
   }, []);
 
   const handleLogout = useCallback(() => {
-    if (network.online) api.updateStatus(false);
+    if (network.online) {
+      const token = localStorage.getItem('cipher_token');
+      api.updateStatus(false).finally(() => {
+        api.logout().finally(() => {
+          if (localStorage.getItem('cipher_token') === token) localStorage.removeItem('cipher_token');
+        });
+      });
+    } else {
+      localStorage.removeItem('cipher_token');
+    }
     localStorage.removeItem('cipher_user_id');
     localStorage.removeItem('cipher_user');
     setUser(null);
@@ -2,6 +2,8 @@ import { useState, useEffect, useCallback, useRef } from 'react';
 import { type Message, addToQueue, getQueue, removeFromQueue, saveMessage } from '@/lib/storage';
 import { syncMessages } from '@/lib/api';
 
+const SYNC_BATCH_SIZE = 30;
+
 export function useMessageQueue(online: boolean) {
   const [queue, setQueue] = useState<Message[]>([]);
   const [syncing, setSyncing] = useState(false);
@@ -22,7 +24,7 @@ export function useMessageQueue(online: boolean) {
     processingRef.current = true;
     setSyncing(true);
 
-    const pending = await getQueue();
+    const pending = (await getQueue()).slice(0, SYNC_BATCH_SIZE);
     if (pending.length > 0) {
       try {
         const payload = pending.map(m => ({
@@ -35,13 +37,13 @@ export function useMessageQueue(online: boolean) {
           for (const msg of pending) {
             const synced = result.results.find((r: { client_id: string }) => r.client_id === msg.id);
             if (synced) {
-              const updated = { ...msg, status: 'delivered' as const };
+              const updated = { ...msg, status: 'sent' as const };
               await saveMessage(updated);
               await removeFromQueue(msg.id);
             }
           }
         }
-        setQueue([]);
+        setQueue(await getQueue());
       } catch {
         for (const msg of pending) {
           const failed = { ...msg, status: 'failed' as const };
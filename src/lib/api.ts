@@ -4,11 +4,21 @@ const MESSAGES_URL = 'https://functions.poehali.dev/095f98e5-52f9-43b3-a2c8-578c
 const STATUSES_URL = 'https://functions.poehali.dev/0f0ea2b7-d2ed-4a9b-883f-05d4e2f5b3dd';
 const WEBRTC_URL = 'https://functions.poehali.dev/804eac05-4299-4054-b8d8-791c06ffcd8b';
 
+const READ_ACTIONS = new Set(['list', 'poll', 'search']);
+// ack only moves the delivery cursor, which the sender's own reads never depend on
+const CURSOR_ACTIONS = new Set(['ack']);
+const READ_AFTER_WRITE_MS = 5000;
+let lastWriteAt = 0;
+
 function getUserId(): string {
   const id = localStorage.getItem('cipher_user_id');
   return id && id !== 'undefined' ? id : '';
 }
 
+function getToken(): string {
+  return localStorage.getItem('cipher_token') || '';
+}
+
 async function doFetch(url: string, fetchOptions: RequestInit): Promise<Response> {
   const res = await fetch(url, fetchOptions);
   if (res.status === 402) {
@@ -24,11 +34,19 @@ async function api(base: string, action: string, options: { method?: string; bod
   const url = `${base}?${qs}`;
 
   const fetchOptions: RequestInit = { method, signal: AbortSignal.timeout(20000) };
+  const headers: Record<string, string> = {};
 
   if (body) {
-    fetchOptions.headers = { 'Content-Type': 'application/json' };
+    headers['Content-Type'] = 'application/json';
     fetchOptions.body = JSON.stringify(body);
   }
+  const token = getToken();
+  if (token) headers['X-Auth-Token'] = token;
+  const sinceWrite = Date.now() - lastWriteAt;
+  if (sinceWrite < READ_AFTER_WRITE_MS) {
+    headers['X-Last-Write'] = String(sinceWrite);
+  }
+  if (Object.keys(headers).length) fetchOptions.headers = headers;
 
   try {
     const res = await doFetch(url, fetchOptions);
@@ -36,6 +54,9 @@ async function api(base: string, action: string, options: { method?: string; bod
       return { error: 'Сервер временно недоступен. Попробуй через минуту.' };
     }
     const data = await res.json().catch(() => ({}));
+    if (res.ok && method !== 'GET' && !READ_ACTIONS.has(action) && !CURSOR_ACTIONS.has(action)) {
+      lastWriteAt = Date.now();
+    }
     if (!res.ok && !data.error) {
       data.error = `Ошибка сервера (${res.status})`;
     }
@@ -60,6 +81,11 @@ export async function login(phone: string, password: string) {
   });
 }
 
+export async function logout() {
+  if (!getToken()) return { ok: true };
+  return api(AUTH_URL, 'logout', { method: 'POST', body: {}, silent: true });
+}
+
 export async function searchUsers(query: string) {
   return api(AUTH_URL, 'search', {
     method: 'POST',
@@ -105,10 +131,10 @@ export async function markChatRead(chatId: string) {
   });
 }
 
-export async function sendMessage(chatId: string, text: string, clientId: string) {
+export async function sendMessage(chatId: string, text: string, clientId: string, attachmentIds?: string[]) {
   return api(MESSAGES_URL, 'send', {
     method: 'POST',
-    body: { user_id: getUserId(), chat_id: chatId, text, client_id: clientId },
+    body: { user_id: getUserId(), chat_id: chatId, text, client_id: clientId, attachment_ids: attachmentIds },
   });
 }
 
@@ -118,15 +144,30 @@ export async function getMessagesList(chatId: string, after?: string) {
   return api(MESSAGES_URL, 'list', { params });
 }
 
-export async function pollMessages(after: string) {
+export async function pollMessages(after: string, receiptsSince?: string) {
   const uid = getUserId();
   if (!uid) return { messages: [] };
-  return api(MESSAGES_URL, 'poll', {
-    params: { after, user_id: uid },
+  const params: Record<string, string> = { after, user_id: uid };
+  if (receiptsSince) params.receipts_since = receiptsSince;
+  return api(MESSAGES_URL, 'poll', { params, silent: true });
+}
+
+export async function ackMessages(upTo: string) {
+  return api(MESSAGES_URL, 'ack', {
+    method: 'POST',
+    body: { user_id: getUserId(), up_to: upTo },
     silent: true,
   });
 }
 
+export async function searchMessages(query: string, chatId?: string, offset = 0) {
+  const uid = getUserId();
+  if (!uid) return { messages: [], next_offset: null };
+  const params: Record<string, string> = { q: query, user_id: uid, offset: String(offset) };
+  if (chatId) params.chat_id = chatId;
+  return api(MESSAGES_URL, 'search', { params });
+}
+
 export async function syncMessages(messages: { chat_id: string; text: string; client_id: string }[]) {
   return api(MESSAGES_URL, 'sync', {
     method: 'POST',
@@ -211,12 +252,14 @@ export async function rejectCall(callId: string) {
   });
 }
 
-export async function pollCall() {
+export async function pollCall(interval?: number) {
   const uid = getUserId();
   if (!uid) return { call: null };
-  return api(WEBRTC_URL, 'poll', { params: { user_id: uid }, silent: true });
+  const params: Record<string, string> = { user_id: uid };
+  if (interval) params.interval = String(interval);
+  return api(WEBRTC_URL, 'poll', { params, silent: true });
 }
 
 export { getUserId };
 
-export default { register, login, searchUsers, updateStatus, getChats, createChat, markChatRead, sendMessage, getMessagesList, pollMessages, syncMessages, updateProfile, deleteMessage, leaveChat, getStatuses, publishStatus, removeStatus, initiateCall, answerCall, sendIceCandidate, endCall, rejectCall, pollCall };
\ No newline at end of file
+export default { register, login, logout, searchUsers, updateStatus, getChats, createChat, markChatRead, sendMessage, getMessagesList, pollMessages, ackMessages, searchMessages, syncMessages, updateProfile, deleteMessage, leaveChat, getStatuses, publishStatus, removeStatus, initiateCall, answerCall, sendIceCandidate, endCall, rejectCall, pollCall };
\ No newline at end of file
@@ -1,4 +1,4 @@
-import { type Chat, type Message } from '@/lib/storage';
+import { type Attachment, type Chat, type Message } from '@/lib/storage';
 
 export interface ServerChat {
   id: string;
@@ -18,6 +18,7 @@ export interface ServerMessage {
   text: string;
   status: string;
   created_at: string;
+  attachments?: Attachment[];
 }
 
 export function toLocalChat(sc: ServerChat): Chat {
@@ -33,6 +34,23 @@ export function toLocalChat(sc: ServerChat): Chat {
   };
 }
 
+export interface ServerReceipt {
+  chat_id: string;
+  delivered_up_to: string;
+  read_up_to: string;
+}
+
+export function toServerTime(ts: number): string {
+  return new Date(ts - new Date(ts).getTimezoneOffset() * 60000).toISOString().slice(0, 23);
+}
+
+export function applyReceipt(msg: Message, receipt: ServerReceipt): Message {
+  if (msg.sender !== 'me' || msg.chatId !== receipt.chat_id || msg.status === 'sending' || msg.status === 'failed' || msg.status === 'read') return msg;
+  if (msg.timestamp <= new Date(receipt.read_up_to).getTime()) return { ...msg, status: 'read' };
+  if (msg.status === 'sent' && msg.timestamp <= new Date(receipt.delivered_up_to).getTime()) return { ...msg, status: 'delivered' };
+  return msg;
+}
+
 export function toLocalMessage(sm: ServerMessage, userId: string): Message {
   return {
     id: sm.id,
@@ -40,6 +58,7 @@ export function toLocalMessage(sm: ServerMessage, userId: string): Message {
     text: sm.text,
     sender: sm.sender_id === userId ? 'me' : 'them',
     timestamp: new Date(sm.created_at).getTime(),
-    status: sm.status === 'delivered' ? 'delivered' : 'sent',
+    status: sm.status === 'read' || sm.status === 'delivered' ? sm.status : 'sent',
+    attachments: sm.attachments?.length ? sm.attachments : undefined,
   };
 }
\ No newline at end of file
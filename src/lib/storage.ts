@@ -1,11 +1,21 @@
+export interface Attachment {
+  id: string;
+  name: string;
+  mime: string;
+  size: number;
+  sha256: string;
+  url: string;
+}
+
 export interface Message {
   id: string;
   chatId: string;
   text: string;
   sender: 'me' | 'them';
   timestamp: number;
-  status: 'sending' | 'sent' | 'delivered' | 'failed';
+  status: 'sending' | 'sent' | 'delivered' | 'read' | 'failed';
   encrypted?: boolean;
+  attachments?: Attachment[];
 }
 
 export interface Chat {
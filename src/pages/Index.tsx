@@ -51,18 +51,21 @@ const Index = () => {
   } = useChatData();
 
   const webrtc = useWebRTC(user?.user_id || null);
-  const incomingPollRef = useRef<ReturnType<typeof setInterval>>();
+  const incomingPollRef = useRef<ReturnType<typeof setTimeout>>();
 
   useEffect(() => {
     if (!user || !network.online) {
-      if (incomingPollRef.current) clearInterval(incomingPollRef.current);
+      if (incomingPollRef.current) clearTimeout(incomingPollRef.current);
       return;
     }
 
-    incomingPollRef.current = setInterval(async () => {
+    let delay = 2000;
+    let stopped = false;
+    const poll = async () => {
       if (webrtc.callState !== 'idle' || incomingCall) return;
       try {
-        const res = await api.pollCall();
+        const res = await api.pollCall(delay);
+        if (res.next_poll_after) delay = res.next_poll_after;
         if (res.call && res.call.callee_id === user.user_id && res.call.status === 'ringing') {
           setIncomingCall({
             id: res.call.id,
@@ -76,9 +79,11 @@ const Index = () => {
           });
         }
       } catch { /* noop */ }
-    }, 2000);
+      if (!stopped) incomingPollRef.current = setTimeout(poll, delay);
+    };
+    incomingPollRef.current = setTimeout(poll, delay);
 
-    return () => { if (incomingPollRef.current) clearInterval(incomingPollRef.current); };
+    return () => { stopped = true; if (incomingPollRef.current) clearTimeout(incomingPollRef.current); };
   }, [user, network.online, webrtc.callState, incomingCall]);
 
   const handleStartCall = useCallback((chat: typeof chats[0], type: 'voice' | 'video') => {